@@ -1,660 +1,718 @@
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
-from flask import render_template, Flask, abort, g, request
+from flask import render_template, Flask, Blueprint, Response, abort, g, jsonify, request
 import logging
 import db
+import facets
+import faq
 import sqlite3
+import re
+import json
+import threading
 from math import ceil
 
 APP = Flask(__name__)
+db.init_app(APP)
+
+ITEMS_PER_PAGE = 100
+
+def like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Paginação e pesquisa feitas no SQL: só a página pedida sai da BD
+# cada lista regista as suas queries (com e sem pesquisa) uma única vez
+def prepare_list(name, table, columns, name_column, order_by):
+    where = "WHERE {} LIKE ? ESCAPE '\\'".format(name_column)
+    for suffix, condition in (('', ''), ('_search', where)):
+        db.prepare(name + '_count' + suffix,
+                   'SELECT COUNT(*) FROM {} {}'.format(table, condition))
+        db.prepare(name + '_page' + suffix,
+                   'SELECT {} FROM {} {} ORDER BY {} LIMIT ? OFFSET ?'
+                   .format(columns, table, condition, order_by))
+
+# página pedida, limitada à última: um número enorme não chega ao SQL
+def clamp_page(page, total):
+    return min(page, max(ceil(total / ITEMS_PER_PAGE), 1))
+
+def paginate(name):
+    page = max(request.args.get('page', 1, type=int), 1)
+    search = request.args.get('search', '').lower()
+
+    suffix, args = '', []
+    if search:
+        suffix = '_search'
+        args.append('%' + like_escape(search) + '%')
+
+    total = db.query(name + '_count' + suffix, args).fetchone()[0]
+    page = clamp_page(page, total)
+    rows = db.query(name + '_page' + suffix,
+                    args + [ITEMS_PER_PAGE, (page-1)*ITEMS_PER_PAGE]).fetchall()
+
+    return rows, page, ceil(total / ITEMS_PER_PAGE), search
+
+# Cache HTTP
+# o conteúdo só muda quando o create_bd.py corre: o ETag é o identificador da
+# build e um If-None-Match igual recebe 304 antes de qualquer query da rota
+MAX_AGE = {'list': 300, 'detail': 3600, 'faq': 86400}
+ROUTE_CLASS = {
+    'get_movie': 'detail', 'get_genre': 'detail', 'get_producer': 'detail',
+    'person_movies': 'detail', 'list_questions': 'faq', 'faq_answer': 'faq',
+    'api.api_show': 'detail', 'api.api_genre': 'detail', 'api.api_company': 'detail',
+    'api.api_person': 'detail', 'api.api_questions': 'faq', 'api.api_faq': 'faq',
+}
+
+def cacheable():
+    return request.method in ('GET', 'HEAD') and request.endpoint not in (None, 'static')
+
+@APP.before_request
+def not_modified():
+    if not cacheable():
+        return None
+    build = db.build_info()
+    if request.if_none_match.contains(build['build']) or \
+            (not request.if_none_match and request.if_modified_since
+             and request.if_modified_since.timestamp() >= build['built_at']):
+        return Response(status=304)
+
+@APP.after_request
+def cache_headers(response):
+    if cacheable() and response.status_code in (200, 304):
+        build = db.build_info()
+        response.set_etag(build['build'])
+        response.last_modified = build['built_at']
+        response.cache_control.public = True
+        response.cache_control.max_age = MAX_AGE[ROUTE_CLASS.get(request.endpoint, 'list')]
+    return response
+
+# Rotas pesadas (coleções inteiras da API e perguntas da FAQ calculadas na hora,
+# com parâmetros): no máximo HEAVY_LIMIT em simultâneo por processo, para que um
+# pico destas não atrase as páginas leves. As respostas pré-calculadas da FAQ são
+# leituras pequenas e não contam. As excedentes recebem 503 logo: esperar por um
+# lugar ocuparia a thread do pedido e o servidor deixaria de aceitar os leves
+HEAVY_LIMIT = 2
+HEAVY_ROUTES = {'api.api_shows', 'api.api_people', 'api.api_genres', 'api.api_companies'}
+FAQ_ROUTES = {'faq_answer', 'api.api_faq'}
+HEAVY = {'slots': threading.BoundedSemaphore(HEAVY_LIMIT)}
+
+def is_heavy():
+    if request.endpoint in HEAVY_ROUTES:
+        return True
+    return request.endpoint in FAQ_ROUTES and faq_query(request.view_args['name'])[1] is not None
+
+@APP.before_request
+def limit_heavy():
+    if not is_heavy():
+        return None
+    if not HEAVY['slots'].acquire(blocking=False):
+        return Response('Demasiados pedidos pesados em curso, tente de novo.', status=503,
+                        headers={'Retry-After': '1'}, mimetype='text/plain')
+    g.heavy = True
+
+# o lugar só é libertado quando a resposta fecha (num stream, no fim dos dados)
+@APP.after_request
+def hold_heavy(response):
+    if g.pop('heavy', False):
+        response.call_on_close(HEAVY['slots'].release)
+    return response
+
+# se o after_request não chegou a correr
+@APP.teardown_request
+def release_heavy(exc=None):
+    if g.pop('heavy', False):
+        HEAVY['slots'].release()
 
 # Start page
+db.prepare('stats', '''
+    SELECT * FROM
+    (SELECT COUNT(*) n_movies FROM shows)
+    JOIN (SELECT COUNT(*) n_people FROM people)
+    JOIN (SELECT COUNT(*) n_genres FROM genres)
+    JOIN (SELECT COUNT(*) n_production_companies FROM companies)
+''')
+
 @APP.route('/')
 def index():
-    stats = db.execute('''
-        SELECT * FROM
-        (SELECT COUNT(*) n_movies FROM shows)
-        JOIN (SELECT COUNT(*) n_people FROM people)
-        JOIN (SELECT COUNT(*) n_genres FROM genres)
-        JOIN (SELECT COUNT(*) n_production_companies FROM companies)
-    ''').fetchone()
+    stats = db.query('stats').fetchone()
     logging.info(stats)
     return render_template('index.html', stats=stats)
 
 # Filmes 
+# paginação por cursor (keyset): cada ordenação tem um índice com a mesma ordem,
+# por isso qualquer página custa o mesmo que a primeira
+# ordenação -> (tabelas, chave, desempate, valor mostrado, sentido)
+SHOW_SORTS = {
+    'title': ('shows s', 's.title', 's.show_id', 's.title', 'ASC'),
+    'releaseDate': ('shows s', "IFNULL(CAST(s.releaseDate AS TEXT), '')", 's.show_id', 's.releaseDate', 'DESC'),
+    'metascore': ('metascore k JOIN shows s ON s.show_id = k.show_id',
+                  'IFNULL(k.metascore, -1)', 'k.show_id', 'k.metascore', 'DESC'),
+    'userscore': ('userscore k JOIN shows s ON s.show_id = k.show_id',
+                  'IFNULL(k.userscore, -1)', 'k.show_id', 'k.userscore', 'DESC'),
+}
+
+def where(conditions):
+    return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+def prepare_show_list():
+    search = "s.title LIKE ? ESCAPE '\\'"
+    for suffix, condition in (('', []), ('_search', [search])):
+        db.prepare('shows_count' + suffix, 'SELECT COUNT(*) FROM shows s ' + where(condition))
+
+        for sort, (table, key, tiebreak, value, direction) in SHOW_SORTS.items():
+            forward = direction
+            backward = 'DESC' if direction == 'ASC' else 'ASC'
+            ahead = '>' if direction == 'ASC' else '<'
+            behind = '<' if direction == 'ASC' else '>'
+            # escrito por extenso porque o SQLite não usa índices de expressões
+            # para delimitar comparações de tuplos (a, b) < (?, ?)
+            cursor = '{0} {{0}}= ? AND ({0} {{0}} ? OR {1} {{0}} ?)'.format(key, tiebreak)
+
+            for name, conditions, order, tail in (
+                    ('offset', condition, forward, 'LIMIT ? OFFSET ?'),
+                    ('after', condition + [cursor.format(ahead)], forward, 'LIMIT ?'),
+                    ('before', condition + [cursor.format(behind)], backward, 'LIMIT ?')):
+                db.prepare('shows_{}_{}{}'.format(sort, name, suffix), '''
+                    SELECT s.show_id, s.title, {value} AS sort_value, {key} AS sort_key
+                    FROM {table}
+                    {where}
+                    ORDER BY {key} {order}, {tiebreak} {order}
+                    {tail}
+                '''.format(value=value, key=key, table=table, tiebreak=tiebreak, order=order,
+                           tail=tail, where=where(conditions)))
+
+    # para os filtros (facetas): todos os show_id por cada ordenação, e as linhas
+    # de uma página já escolhida (os ids vêm numa lista JSON)
+    for sort, (table, key, tiebreak, value, direction) in SHOW_SORTS.items():
+        db.prepare('shows_{}_order'.format(sort), '''
+            SELECT s.show_id FROM {table} ORDER BY {key} {order}, {tiebreak} {order}
+        '''.format(table=table, key=key, tiebreak=tiebreak, order=direction))
+        db.prepare('shows_{}_ids'.format(sort), '''
+            SELECT s.show_id, s.title, {value} AS sort_value, {key} AS sort_key
+            FROM {table}
+            WHERE s.show_id IN (SELECT value FROM json_each(?))
+            ORDER BY {key} {order}, {tiebreak} {order}
+        '''.format(value=value, key=key, table=table, tiebreak=tiebreak, order=direction))
+    db.prepare('shows_ids_search', "SELECT show_id FROM shows WHERE title LIKE ? ESCAPE '\\'")
+
+prepare_show_list()
+
+# Filtros por género, rating, ano, temporadas e scores (facets.py): os shows que
+# passam e as contagens de cada opção saem do índice de bitmaps, sem SQL
+SHOW_ORDERS = {sort: 'shows_{}_order'.format(sort) for sort in SHOW_SORTS}
+
+def facet_filters():
+    chosen = {}
+    for name, (_, width) in facets.FACETS.items():
+        if width is None:
+            values = request.args.getlist(name)
+            if values:
+                chosen[name] = values
+        else:
+            low = request.args.get(name + '_min', type=int)
+            high = request.args.get(name + '_max', type=int)
+            if low is not None or high is not None:
+                chosen[name] = (low, high)
+    return chosen
+
+# parâmetros do pedido a manter nos links (ordenação, pesquisa e filtros)
+def facet_params(sort, search):
+    params = {'sort': sort, 'search': search}
+    for name, (_, width) in facets.FACETS.items():
+        for key in ([name] if width is None else [name + '_min', name + '_max']):
+            if request.args.get(key):
+                params[key] = request.args.getlist(key)
+    return params
+
+def select_shows(search, chosen):
+    index = facets.current(SHOW_ORDERS)
+    base = None
+    if search:
+        rows = db.query('shows_ids_search', ['%' + like_escape(search) + '%']).fetchall()
+        base = index.bitmap([row[0] for row in rows])
+    bits, counts = index.select(chosen, base)
+    return index, bits, counts
+
+# página 'page' dos shows filtrados (limitada à última), o total e as
+# contagens das facetas
+def filtered_shows(sort, page, search, chosen):
+    index, bits, counts = select_shows(search, chosen)
+    ids = index.ordered(bits, sort)
+    page = clamp_page(page, len(ids))
+    offset = (page-1)*ITEMS_PER_PAGE
+    movies = db.query('shows_{}_ids'.format(sort),
+                      [json.dumps(ids[offset:offset + ITEMS_PER_PAGE].tolist())]).fetchall()
+    return movies, page, len(ids), counts
+
+# limites de um INTEGER do SQLite (64 bits com sinal)
+SQL_INT = range(-2**63, 2**63)
+
+def parse_cursor(raw, sort):
+    value, _, show_id = raw.rpartition(',')
+    try:
+        show_id = int(show_id)
+        if sort in ('metascore', 'userscore'):
+            value = int(value)
+    except ValueError:
+        abort(400, 'Cursor inválido: {}'.format(raw))
+    if show_id not in SQL_INT or (isinstance(value, int) and value not in SQL_INT):
+        abort(400, 'Cursor inválido: {}'.format(raw))
+    return [value, value, show_id]
+
+def make_cursor(row):
+    return '{},{}'.format(row['sort_key'], row['show_id'])
+
 @APP.route('/shows/')
 def list_movies():
-    page = int(request.args.get('page', 1))
+    sort = request.args.get('sort', 'title')
+    if sort not in SHOW_SORTS:
+        abort(400, 'Ordenação {} não existe.'.format(sort))
+    page = max(request.args.get('page', 1, type=int), 1)
     search = request.args.get('search', '').lower()
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    chosen = facet_filters()
+    params = facet_params(sort, search)
+
+    # com filtros a página sai do índice de bitmaps, paginada pelo número
+    if chosen:
+        movies, page, total, counts = filtered_shows(sort, page, search, chosen)
+        return render_template('movie-list.html', movies=movies, page=page,
+                               total_pages=ceil(total / ITEMS_PER_PAGE), search=search,
+                               sort=sort, sorts=list(SHOW_SORTS), facets=counts,
+                               params=params, total=total, filtered=True)
+
+    suffix, args = '', []
+    if search:
+        suffix = '_search'
+        args.append('%' + like_escape(search) + '%')
+
+    total = db.query('shows_count' + suffix, args).fetchone()[0]
+    page = clamp_page(page, total)
+    _, _, counts = select_shows(search, chosen)
+
+    # pede-se mais uma linha para saber se existe a página seguinte/anterior
+    limit = ITEMS_PER_PAGE + 1
+    if after:
+        movies = db.query('shows_{}_after{}'.format(sort, suffix),
+                          args + parse_cursor(after, sort) + [limit]).fetchall()
+        has_prev, has_next = True, len(movies) > ITEMS_PER_PAGE
+        movies = movies[:ITEMS_PER_PAGE]
+    elif before:
+        movies = db.query('shows_{}_before{}'.format(sort, suffix),
+                          args + parse_cursor(before, sort) + [limit]).fetchall()
+        has_prev, has_next = len(movies) > ITEMS_PER_PAGE, True
+        movies = movies[:ITEMS_PER_PAGE][::-1]
+    else:
+        movies = db.query('shows_{}_offset{}'.format(sort, suffix),
+                          args + [limit, (page-1)*ITEMS_PER_PAGE]).fetchall()
+        has_prev, has_next = page > 1, len(movies) > ITEMS_PER_PAGE
+        movies = movies[:ITEMS_PER_PAGE]
+
+    return render_template('movie-list.html', movies=movies, page=page,
+                           total_pages=ceil(total / ITEMS_PER_PAGE), search=search,
+                           sort=sort, sorts=list(SHOW_SORTS), facets=counts,
+                           params=params, total=total, filtered=False,
+                           prev_cursor=make_cursor(movies[0]) if has_prev and movies else None,
+                           next_cursor=make_cursor(movies[-1]) if has_next and movies else None)
 
-    all_movies = db.execute('''
-        SELECT show_id, title
-        FROM shows
-        ORDER BY title
-    ''').fetchall()
+# Cada filme individual 
+# tudo o que a página precisa em duas queries: o cabeçalho (com os scores) e
+# uma única lista de ligações (géneros, pessoas e produtoras) marcada pelo papel
+SHOW_ROLES = ['genre', 'actor', 'creator', 'writer', 'director', 'producer']
+
+db.prepare('show_header', '''
+    SELECT s.show_id, title, releaseDate, rating, num_seasons, tagline, description, duration,
+           m.metascore, u.userscore,
+           m.show_id IS NOT NULL AND u.show_id IS NOT NULL AS has_scores
+    FROM shows s
+    LEFT JOIN metascore m ON m.show_id = s.show_id
+    LEFT JOIN userscore u ON u.show_id = s.show_id
+    WHERE s.show_id = ?
+''')
+
+db.prepare('show_links', '''
+    SELECT 'genre' AS role, NULL AS person_id, NULL AS producer_id, name
+    FROM types NATURAL JOIN genres WHERE show_id = ?
+    UNION ALL
+    SELECT role, person_id, NULL, name
+    FROM person_roles NATURAL JOIN people WHERE show_id = ?
+    UNION ALL
+    SELECT 'producer', NULL, producer_id, name
+    FROM production NATURAL JOIN companies WHERE show_id = ?
+    ORDER BY role, person_id, producer_id, name
+''')
+
+db.prepare('show_similar', '''
+    SELECT s.show_id, s.title, ss.score
+    FROM similar_shows ss JOIN shows s ON s.show_id = ss.similar_id
+    WHERE ss.show_id = ?
+    ORDER BY ss.rank
+''')
+
+def show_detail(id):
+    movie = db.query('show_header', [id]).fetchone()
 
-    filtered_movies = [m for m in all_movies if search in m['title'].lower()]
+    if movie is None:
+        return None, None
 
-    items_per_page = 100
-    total_pages = ceil(len(filtered_movies) / items_per_page)
-    movies = filtered_movies[(page-1)*items_per_page : page*items_per_page]
+    links = db.query('show_links', [id] * 3).fetchall()
 
-    return render_template('movie-list.html', movies=movies, page=page, total_pages=total_pages, search=search)
+    groups = {role: [] for role in SHOW_ROLES}
+    for row in links:
+        groups[row['role']].append(row)
+    groups['scores'] = [movie] if movie['has_scores'] else []
+    groups['similar'] = db.query('show_similar', [id]).fetchall()
+
+    return movie, groups
 
-# Cada filme individual 
 @APP.route('/shows/<int:id>/')
 def get_movie(id):
-    movie = db.execute('''
-        SELECT show_id, title, releaseDate, rating, num_seasons, tagline, description, duration
-        FROM shows
-        WHERE show_id = ?
-    ''', [id]).fetchone()
+    movie, groups = show_detail(id)
 
     if movie is None:
         abort(404, 'Show id {} não existe.'.format(id))
 
-    genres = db.execute('''
-        SELECT g.name
-        FROM types 
-        NATURAL JOIN genres g
-        WHERE show_id = ?
-        ORDER BY g.name
-    ''', [id]).fetchall()
-
-    actors = db.execute('''
-        SELECT name, person_id
-        FROM top_cast 
-        NATURAL JOIN people
-        WHERE show_id = ?
-    ''', [id]).fetchall()
-
-    scores = db.execute('''
-        SELECT metascore, userscore
-        FROM metascore
-        NATURAL JOIN userscore
-        WHERE show_id = ?                  
-    ''', [id]).fetchall()
-
-    creators = db.execute('''
-        SELECT name, person_id
-        FROM creators
-        NATURAL JOIN people
-        WHERE show_id = ?
-    ''', [id]).fetchall()
-
-    writers = db.execute('''
-        SELECT name, person_id
-        FROM writers
-        NATURAL JOIN people
-        WHERE show_id = ?
-    ''', [id]).fetchall()
-
-    directors = db.execute('''
-        SELECT name, person_id
-        FROM directors
-        NATURAL JOIN people
-        WHERE show_id = ?
-    ''', [id]).fetchall()
-
-    producers = db.execute('''
-        SELECT name, producer_id
-        FROM production
-        NATURAL JOIN companies
-        WHERE show_id = ?
-    ''', [id]).fetchall()
-
     return render_template('movie.html',
                            movie=movie,
-                           genres=genres,
-                           actors=actors,
-                           scores=scores,
-                           creators=creators,
-                           writers=writers,
-                           directors=directors,
-                           producers=producers)
+                           genres=groups['genre'],
+                           actors=groups['actor'],
+                           scores=groups['scores'],
+                           creators=groups['creator'],
+                           writers=groups['writer'],
+                           directors=groups['director'],
+                           producers=groups['producer'],
+                           similar=groups['similar'])
 
 # Genres
+prepare_list('genres', 'genres', 'genre_id, name', 'name', 'name, genre_id')
+
 @APP.route('/genres/')
 def list_genres():
-    page = int(request.args.get('page', 1))
-    search = request.args.get('search', '').lower()
-
-    all_genres = db.execute('''
-        SELECT genre_id, name
-        FROM genres
-        ORDER BY name
-    ''').fetchall()
-
-    filtered_genres = [g for g in all_genres if search in g['name'].lower()]
-
-    items_per_page = 100
-    total_pages = ceil(len(filtered_genres) / items_per_page)
-    genres = filtered_genres[(page-1)*items_per_page : page*items_per_page]
+    genres, page, total_pages, search = paginate('genres')
 
     return render_template('genre-list.html', genres=genres, page=page, total_pages=total_pages, search=search)
 
+db.prepare('genre_info', '''
+    SELECT name AS genre_name, COUNT(show_id) AS total
+    FROM genres
+    NATURAL JOIN types
+    WHERE genre_id = ?
+    ORDER BY name
+''')
+
+db.prepare('genre_shows', '''
+    SELECT show_id, title
+    FROM shows
+    NATURAL JOIN types
+    NATURAL JOIN genres
+    WHERE genre_id = ?
+    ORDER BY title, show_id
+''')
+
 @APP.route('/genres/<int:id>/')
 def get_genre(id):
-    info = db.execute('''
-        SELECT name AS genre_name, COUNT(show_id) AS total
-        FROM genres
-        NATURAL JOIN types
-        WHERE genre_id = ?
-        ORDER BY name
-    ''', [id]).fetchone()
-
-    movies = db.execute('''
-        SELECT show_id, title
-        FROM shows
-        NATURAL JOIN types
-        NATURAL JOIN genres
-        WHERE genre_id = ?
-        ORDER BY title
-    ''', [id]).fetchall()
+    info = db.query('genre_info', [id]).fetchone()
+    movies = db.query('genre_shows', [id]).fetchall()
 
     return render_template('genre.html', info=info, movies=movies)
 
 # Production companies
+prepare_list('companies', 'companies', 'producer_id, name', 'name', 'name, producer_id')
+
 @APP.route('/production-companies/')
 def list_producers():
-    page = int(request.args.get('page', 1))
-    search = request.args.get('search', '').lower()
-
-    all_companies = db.execute('''
-        SELECT producer_id, name
-        FROM companies
-        ORDER BY name
-    ''').fetchall()
-
-    filtered_companies = [c for c in all_companies if search in c['name'].lower()]
-
-    items_per_page = 100
-    total_pages = ceil(len(filtered_companies) / items_per_page)
-    companies = filtered_companies[(page-1)*items_per_page : page*items_per_page]
+    companies, page, total_pages, search = paginate('companies')
 
     return render_template('production-companies.html', companies=companies, page=page, total_pages=total_pages, search=search)
 
+db.prepare('producer_info', '''
+    SELECT name AS producer_name, COUNT(show_id) AS total
+    FROM companies
+    NATURAL JOIN production
+    WHERE producer_id = ?
+    ORDER BY name
+''')
+
+db.prepare('producer_shows', '''
+    SELECT show_id, title
+    FROM shows
+    NATURAL JOIN production
+    NATURAL JOIN companies
+    WHERE producer_id = ?
+    ORDER BY title, show_id
+''')
+
 @APP.route('/production-companies/<int:id>/')
 def get_producer(id):
-    info = db.execute('''
-        SELECT name AS producer_name, COUNT(show_id) AS total
-        FROM companies
-        NATURAL JOIN production
-        WHERE producer_id = ?
-        ORDER BY name
-    ''', [id]).fetchone()
-
-    movies = db.execute('''
-        SELECT show_id, title
-        FROM shows
-        NATURAL JOIN production
-        NATURAL JOIN companies
-        WHERE producer_id = ?
-        ORDER BY title
-    ''', [id]).fetchall()
+    info = db.query('producer_info', [id]).fetchone()
+    movies = db.query('producer_shows', [id]).fetchall()
 
     return render_template('producer.html', info=info, movies=movies)
 
 # People
+# os papéis de cada pessoa já vêm resumidos da BD (people.roles)
+PEOPLE_COLUMNS = 'p.person_id, p.name, p.roles'
+
+prepare_list('people', 'people p', PEOPLE_COLUMNS, 'p.name', 'p.name, p.person_id')
+
 @APP.route('/people/')
 def list_people():
-    page = int(request.args.get('page', 1))
-    search = request.args.get('search', '').lower()
-
-    all_people = db.execute('''
-        SELECT 
-            p.person_id,
-            p.name,
-            REPLACE(GROUP_CONCAT(DISTINCT r.role), ',', ', ') AS roles
-        FROM people p
-        LEFT JOIN (
-            SELECT DISTINCT person_id, 'actor' AS role FROM top_cast
-            UNION 
-            SELECT DISTINCT person_id, 'director' AS role FROM directors
-            UNION 
-            SELECT DISTINCT person_id, 'creator' AS role FROM creators
-            UNION 
-            SELECT DISTINCT person_id, 'writer' AS role FROM writers
-        ) r ON p.person_id = r.person_id
-        GROUP BY p.person_id, p.name
-        ORDER BY p.name;
-    ''').fetchall()
-
-    filtered_people = [p for p in all_people if search in p['name'].lower()]
-
-    items_per_page = 100
-    total_pages = ceil(len(filtered_people) / items_per_page)
-    people = filtered_people[(page-1)*items_per_page : page*items_per_page]
+    people, page, total_pages, search = paginate('people')
 
     return render_template('people-list.html', people=people, page=page, total_pages=total_pages, search=search)
 
+db.prepare('person', """
+    SELECT person_id, name
+    FROM people
+    WHERE person_id = ?
+""")
+
+db.prepare('person_shows', """
+    SELECT m.show_id, m.title, r.role
+    FROM person_roles r
+    JOIN shows m ON m.show_id = r.show_id
+    WHERE r.person_id = ?
+    ORDER BY m.title, m.show_id, r.role
+""")
+
+# Colaboradores mais frequentes (tabela collaborations, calculada pelo create_bd.py)
+COLLABORATORS = 10
+MAX_COLLABORATORS = 100
+
+db.prepare('person_collaborators', """
+    SELECT c.person_b AS person_id, p.name, c.shared_shows, c.roles
+    FROM collaborations c
+    JOIN people p ON p.person_id = c.person_b
+    WHERE c.person_a = ?
+    ORDER BY c.shared_shows DESC, p.name
+    LIMIT ?
+""")
+
 @APP.route('/person/<int:id>/')
 def person_movies(id):
-    person = db.execute("""
-        SELECT person_id, name
-        FROM people
-        WHERE person_id = ?
-    """, [id]).fetchone()
-
-    movies = db.execute("""
-        SELECT m.show_id, m.title, r.role
-        FROM shows m
-        LEFT JOIN (
-            SELECT show_id, person_id, 'actor' AS role FROM top_cast
-            UNION ALL
-            SELECT show_id, person_id, 'director' AS role FROM directors
-            UNION ALL
-            SELECT show_id, person_id, 'creator' AS role FROM creators
-            UNION ALL
-            SELECT show_id, person_id, 'writer' AS role FROM writers
-        ) r
-        ON m.show_id = r.show_id
-        WHERE r.person_id = ?
-        ORDER BY m.title, r.role
-    """, [id]).fetchall()
-
-    return render_template("person.html", person=person, movies=movies)
+    person = db.query('person', [id]).fetchone()
+    movies = db.query('person_shows', [id]).fetchall()
+    collaborators = db.query('person_collaborators', [id, COLLABORATORS]).fetchall()
+
+    return render_template("person.html", person=person, movies=movies,
+                           collaborators=collaborators)
+
+# Pesquisa (FTS5): cada palavra é um prefixo, resultados ordenados por bm25
+def fts_query(text):
+    return ' '.join('"{}"*'.format(w) for w in re.findall(r'\w+', text))
+
+db.prepare('search', '''
+    SELECT kind, id, name FROM (
+        SELECT 'show' AS kind, rowid AS id, title AS name,
+               bm25(shows_fts, 10.0, 1.0, 2.0) AS score
+        FROM shows_fts
+        WHERE shows_fts MATCH ?
+        UNION ALL
+        SELECT 'person', rowid, name, bm25(people_fts)
+        FROM people_fts
+        WHERE people_fts MATCH ?
+        UNION ALL
+        SELECT 'company', rowid, name, bm25(companies_fts)
+        FROM companies_fts
+        WHERE companies_fts MATCH ?
+    )
+    ORDER BY score
+    LIMIT ?
+''')
+
+@APP.route('/search/')
+def search():
+    q = request.args.get('q', '').strip()
+    match = fts_query(q)
+
+    results = []
+    if match:
+        results = db.query('search', [match, match, match, ITEMS_PER_PAGE]).fetchall()
+
+    return render_template('search.html', q=q, results=results)
 
 # FAQ e perguntas 
+# as respostas são pré-calculadas pelo create_bd.py (ver faq.py)
+for name in faq.QUERIES:
+    db.prepare('faq_' + name, 'SELECT * FROM faq_{} ORDER BY rowid'.format(name))
+# perguntas com parâmetros: com outros valores no pedido são calculadas na hora
+for name in faq.PARAMS:
+    db.prepare('faq_{}_live'.format(name), faq.QUERIES[name])
+
+# nome da query e argumentos para a pergunta pedida (valores fora dos limites
+# são ajustados, como o ?limit= dos colaboradores)
+def faq_query(name):
+    values = {}
+    for key, (_, low, high) in faq.PARAMS.get(name, {}).items():
+        value = request.args.get(key, type=int)
+        if value is not None:
+            values[key] = min(max(value, low), high)
+    if not values:
+        return 'faq_' + name, None
+    return 'faq_{}_live'.format(name), faq.arguments(name, values)
+
 @APP.route('/faq/')
 def list_questions():
-    questions = [
-        ("p1", "Highest metascore by genre"),
-        ("p2", "Highest userscore by genre"),
-        ("p3", "Percentage histogram of movies by metascore range"),
-        ("p4", "Top 20 largest absolute difference meta vs user"),
-        ("p5", "Show with highest metascore each year"),
-        ("p6", "Shows with metascore higher than the average of their genre"),
-        ("p7", "Shows with the same main cast in different years"),
-        ("p8", "Shows where a person had different roles"),
-        ("p9", "Top 100 shows with most people in production"),
-        ("p10","Bottom 100 shows with least people in production"),
-        ("p11","Top 5 Genres with Most Movies"),
-        ("p12","Genre with Highest Metascore by Decade"),
-        ("p13","Genre with Highest Userscore by Decade"),
-    ]
-    return render_template("faq.html", questions=questions)
-
-# --------------------------
-# p1 — Maior metascore por género
-# --------------------------
-@APP.route('/faq/p1/')
-def pergunta1():
-    p1 = db.execute("""
-        SELECT g.name, s.title, m.metascore
-        FROM shows s
-        NATURAL JOIN metascore m
-        NATURAL JOIN types
-        NATURAL JOIN genres g
-        WHERE m.metascore = (
-            SELECT MAX(m2.metascore)
-            FROM metascore m2
-            NATURAL JOIN types 
-            NATURAL JOIN genres g1
-            WHERE g1.name = g.name
-        )
-        AND m.metascore_count = (
-            SELECT MAX(m3.metascore_count)
-            FROM metascore m3
-            NATURAL JOIN types
-            NATURAL JOIN genres g2
-            WHERE g2.genre_id = g.genre_id AND m3.metascore = m.metascore
-        )
-        ORDER BY g.name;
-    """).fetchall()
-
-    return render_template("p1.html", p1=p1)
-
-
-# --------------------------
-# p2 — Maior userscore por género
-# --------------------------
-@APP.route('/faq/p2/')
-def pergunta2():
-    p2 = db.execute("""
-        SELECT g.name, s.title, u.userscore
-        FROM shows s
-        NATURAL JOIN userscore u
-        NATURAL JOIN types
-        NATURAL JOIN genres g
-        WHERE u.userscore = (
-            SELECT MAX(u2.userscore)
-            FROM userscore u2
-            NATURAL JOIN types 
-            NATURAL JOIN genres g1
-            WHERE g1.name = g.name
-        )
-        AND u.userscore_count = (
-            SELECT MAX(u3.userscore_count)
-            FROM userscore u3
-            NATURAL JOIN types
-            NATURAL JOIN genres g2
-            WHERE g2.genre_id = g.genre_id AND u3.userscore = u.userscore
-        )
-        ORDER BY g.name;
-    """).fetchall()
-
-    return render_template("p2.html", p2=p2)
-
-
-# --------------------------
-# p3 — histograma percentual de filmes por faixa de metascore
-# --------------------------
-@APP.route('/faq/p3/')
-def pergunta3():
-    p3 = db.execute("""
-        WITH Total AS (
-            SELECT COUNT(*) AS total_filmes
-            FROM metascore
-        ),
-        Buckets AS (
-            SELECT 
-                (metascore / 20) * 20 AS bucket_start,
-                COUNT(*) AS total_in_bucket
-            FROM metascore
-            GROUP BY bucket_start
-        )
-        SELECT
-            bucket_start || '-' || (bucket_start + 19) AS interval,
-            ROUND((CAST(total_in_bucket AS REAL) / (SELECT total_filmes FROM Total)) * 100, 2) AS percent
-        FROM Buckets
-        ORDER BY bucket_start;
-    """).fetchall()
-    return render_template("p3.html", p3=p3)
-
-
-
-# --------------------------
-# p4 — Top 20 maior diferença absoluta meta vs user
-# --------------------------
-@APP.route('/faq/p4/')
-def pergunta4():
-    p4 = db.execute("""
-        SELECT s.title, ABS(m.metascore - u.userscore) AS diferenca
-        FROM shows s
-        NATURAL JOIN metascore m
-        NATURAL JOIN userscore u
-        WHERE metascore_count != 0 AND userscore_count != 0
-        ORDER BY diferenca DESC, s.title
-        LIMIT 20;
-    """).fetchall()
-
-    return render_template("p4.html", p4=p4)
-
-
-# --------------------------
-# p5 — Filme com maior metascore em cada ano
-# --------------------------
-@APP.route('/faq/p5/')
-def p5():
-    p5 = db.execute("""
-        WITH MaxMetascorePerYear AS (
-        SELECT substr(s.releaseDate,1,4) AS year,
-            MAX(m.metascore) AS max_metascore
-        FROM shows s
-        JOIN metascore m ON s.show_id = m.show_id
-        WHERE m.metascore IS NOT NULL
-        GROUP BY year
-        )
-        SELECT s.title, s.releaseDate, substr(s.releaseDate,1,4) AS year, m.metascore
-        FROM MaxMetascorePerYear mm
-        JOIN shows s ON substr(s.releaseDate,1,4) = mm.year
-        JOIN metascore m ON s.show_id = m.show_id
-        WHERE m.metascore = mm.max_metascore
-        AND s.show_id = (
-            SELECT MIN(s2.show_id)
-            FROM shows s2
-            JOIN metascore m2 ON s2.show_id = m2.show_id
-            WHERE substr(s2.releaseDate,1,4) = mm.year
-            AND m2.metascore = mm.max_metascore
-        )
-        ORDER BY year;
-    """).fetchall()
-    return render_template('p5.html', p5=p5)
-
-
-
-# --------------------------
-# p6 — Filmes com metascore maior que a média do seu género
-# --------------------------
-@APP.route('/faq/p6/')
-def pergunta6():
-    p6 = db.execute("""
-        SELECT 
-            s.title AS title,
-            g.name AS genre,
-            m.metascore AS metascore
-        FROM shows s
-        JOIN metascore m ON s.show_id = m.show_id
-        JOIN types t ON s.show_id = t.show_id
-        JOIN genres g ON t.genre_id = g.genre_id
-        WHERE m.metascore IS NOT NULL
-        AND m.metascore > (
-            SELECT AVG(m2.metascore)
-            FROM shows s2
-            JOIN metascore m2 ON s2.show_id = m2.show_id
-            JOIN types t2 ON s2.show_id = t2.show_id
-            WHERE t2.genre_id = g.genre_id
-        )
-        ORDER BY g.name, m.metascore DESC;
-
-    """).fetchall()
-
-    return render_template("p6.html", p6=p6)
-
-
-
-
-# --------------------------
-# p7 — Shows com o mesmo elenco principal em anos diferentes
-# --------------------------
-@APP.route('/faq/p7/')
-def pergunta7():
-    p7 = db.execute("""
-        WITH PrincipalCast AS (
-            SELECT t.show_id,
-                   GROUP_CONCAT(t.person_id, ',') AS principal_cast_list
-            FROM top_cast t
-            WHERE t.person_id IN (
-                SELECT person_id
-                FROM top_cast t2
-                WHERE t2.show_id = t.show_id
-                ORDER BY person_id ASC
-                LIMIT 5
-            )
-            GROUP BY t.show_id
-            HAVING COUNT(*) = 5
-        )
-        SELECT
-            s1.title AS show_1_title,
-            s2.title AS show_2_title,
-            s1.releaseDate AS show_1_year,
-            s2.releaseDate AS show_2_year
-        FROM PrincipalCast pc1
-        JOIN PrincipalCast pc2
-          ON pc1.principal_cast_list = pc2.principal_cast_list
-         AND pc1.show_id < pc2.show_id
-        JOIN shows s1 ON pc1.show_id = s1.show_id
-        JOIN shows s2 ON pc2.show_id = s2.show_id
-        WHERE STRFTIME('%Y', s1.releaseDate) <> STRFTIME('%Y', s2.releaseDate);
-    """).fetchall()
-
-    return render_template("p7.html", p7=p7)
-
-
-
-# --------------------------
-# p8 — Shows onde uma pessoa teve papéis diferentes
-# --------------------------
-@APP.route('/faq/p8/')
-def pergunta8():
-    p8 = db.execute("""
-        SELECT DISTINCT s.title, p.name
-        FROM shows s
-        LEFT JOIN directors d ON s.show_id = d.show_id
-        LEFT JOIN writers w ON s.show_id = w.show_id
-        LEFT JOIN creators c ON s.show_id = c.show_id
-        LEFT JOIN top_cast tc ON s.show_id = tc.show_id
-        LEFT JOIN people p ON p.person_id = COALESCE(d.person_id, w.person_id, c.person_id, tc.person_id)
-        WHERE (d.person_id IS NOT NULL AND w.person_id = d.person_id)
-           OR (d.person_id IS NOT NULL AND tc.person_id = d.person_id)
-           OR (d.person_id IS NOT NULL AND c.person_id = d.person_id)
-           OR (w.person_id IS NOT NULL AND tc.person_id = w.person_id)
-           OR (w.person_id IS NOT NULL AND c.person_id = w.person_id)
-        ORDER BY s.title;
-    """).fetchall()
-
-    return render_template("p8.html", p8=p8)
-
-
-# --------------------------
-# p9 — Top 100 shows com mais pessoas na produção
-# --------------------------
-@APP.route('/faq/p9/')
-def pergunta9():
-    p9 = db.execute("""
-        SELECT s.title, 
-               COUNT(DISTINCT d.person_id) +
-               COUNT(DISTINCT w.person_id) +
-               COUNT(DISTINCT c.person_id) AS total_people
-        FROM shows s
-        LEFT JOIN directors d ON s.show_id = d.show_id
-        LEFT JOIN writers w ON s.show_id = w.show_id
-        LEFT JOIN creators c ON s.show_id = c.show_id
-        GROUP BY s.title
-        ORDER BY total_people DESC
-        LIMIT 100;
-    """).fetchall()
-
-    return render_template("p9.html", p9=p9)
-
-
-# --------------------------
-# p10 — Bottom 100 shows com menos pessoas (cast+writer+creator+director)
-# --------------------------
-@APP.route('/faq/p10/')
-def pergunta10():
-    p10 = db.execute("""
-        SELECT s.title,
-               COUNT(DISTINCT d.person_id) +
-               COUNT(DISTINCT w.person_id) +
-               COUNT(DISTINCT c.person_id) AS total_people
-        FROM shows s
-        LEFT JOIN directors d ON s.show_id = d.show_id
-        LEFT JOIN writers w ON s.show_id = w.show_id
-        LEFT JOIN creators c ON s.show_id = c.show_id
-        GROUP BY s.title
-        HAVING total_people > 0
-        ORDER BY total_people
-        LIMIT 100;
-    """).fetchall()
-
-    return render_template("p10.html", p10=p10)
-
-
-# --------------------------
-# p11 — Top 5 Gêneros com Mais Filmes
-# --------------------------
-
-@APP.route('/faq/p11/')
-def pergunta11():
-    p11 = db.execute("""
-        SELECT 
-            g.name AS genre,
-            COUNT(t.show_id) AS total_movies
-        FROM genres g
-        JOIN types t ON g.genre_id = t.genre_id
-        GROUP BY g.genre_id
-        ORDER BY total_movies DESC
-        LIMIT 5;
-    """).fetchall()
-    return render_template("p11.html", p11=p11)
-
-# --------------------------
-# p12 — Gênero com Maior Metascore por Década
-# --------------------------
-
-
-@APP.route('/faq/p12/')
-def pergunta12():
-    p12 = db.execute("""
-        WITH MetaPerDecade AS (
-            SELECT 
-                (CAST(substr(s.releaseDate,1,4) AS INTEGER) / 10) * 10 AS decade,
-                g.genre_id,
-                g.name AS genre,
-                MAX(m.metascore) AS max_metascore,
-                COUNT(*) AS film_count
-            FROM shows s
-            JOIN types t ON s.show_id = t.show_id
-            JOIN genres g ON t.genre_id = g.genre_id
-            JOIN metascore m ON s.show_id = m.show_id
-            WHERE releaseDate IS NOT NULL
-            AND length(releaseDate) >= 4
-            AND substr(releaseDate,1,4) GLOB '[0-9][0-9][0-9][0-9]'
-            GROUP BY decade, g.genre_id
-        ),
-        Ranked AS (
-            SELECT 
-                decade,
-                genre,
-                max_metascore,
-                film_count,
-                ROW_NUMBER() OVER (
-                    PARTITION BY decade
-                    ORDER BY max_metascore DESC, film_count DESC, genre_id ASC
-                ) AS rn
-            FROM MetaPerDecade
-        )
-        SELECT decade, genre, max_metascore
-        FROM Ranked
-        WHERE rn = 1
-        ORDER BY decade;
-    """).fetchall()
-    return render_template("p12.html", p12=p12)
-
-# --------------------------
-# p13 — Gênero com Maior Userscore por Década
-# --------------------------
-
-@APP.route('/faq/p13/')
-def pergunta13():
-    p13 = db.execute("""
-        WITH UserPerDecade AS (
-            SELECT 
-                (CAST(substr(s.releaseDate,1,4) AS INTEGER) / 10) * 10 AS decade,
-                g.genre_id,
-                g.name AS genre,
-                MAX(u.userscore) AS max_userscore,
-                COUNT(*) AS film_count
-            FROM shows s
-            JOIN types t ON s.show_id = t.show_id
-            JOIN genres g ON t.genre_id = g.genre_id
-            JOIN userscore u ON s.show_id = u.show_id
-            WHERE releaseDate IS NOT NULL
-              AND length(releaseDate) >= 4
-              AND substr(releaseDate,1,4) GLOB '[0-9][0-9][0-9][0-9]'
-            GROUP BY decade, g.genre_id
-        ),
-        Ranked AS (
-            SELECT 
-                decade,
-                genre,
-                max_userscore,
-                film_count,
-                ROW_NUMBER() OVER (
-                    PARTITION BY decade
-                    ORDER BY max_userscore DESC, film_count DESC, genre_id ASC
-                ) AS rn
-            FROM UserPerDecade
-        )
-        SELECT decade, genre, max_userscore
-        FROM Ranked
-        WHERE rn = 1
-        ORDER BY decade;
-    """).fetchall()
-    
-    return render_template("p13.html", p13=p13)
+    return render_template("faq.html", questions=faq.QUESTIONS)
+
+@APP.route('/faq/<name>/')
+def faq_answer(name):
+    if name not in faq.QUERIES:
+        abort(404, 'Pergunta {} não existe.'.format(name))
+
+    rows = db.query(*faq_query(name)).fetchall()
+
+    return render_template(name + '.html', **{name: rows})
+
+# API JSON (/api/v1/)
+# as coleções saem em NDJSON (uma linha por registo) lidas diretamente do
+# cursor, sem passar pela cache nem carregar a lista toda em memória
+API = Blueprint('api', __name__, url_prefix='/api/v1')
+
+def stream(name, args=None):
+    rows, done = db.query_stream(name, args)
+    response = Response((json.dumps(dict(row), ensure_ascii=False) + '\n' for row in rows),
+                        mimetype='application/x-ndjson')
+    response.call_on_close(done)
+    return response
+
+def not_found(message):
+    return jsonify(error=message), 404
+
+db.prepare('api_shows', '''
+    SELECT s.show_id, title, releaseDate, rating, num_seasons, duration,
+           m.metascore, u.userscore
+    FROM shows s
+    LEFT JOIN metascore m ON m.show_id = s.show_id
+    LEFT JOIN userscore u ON u.show_id = s.show_id
+    ORDER BY s.show_id
+''')
+
+db.prepare('api_people', 'SELECT {} FROM people p ORDER BY p.person_id'.format(PEOPLE_COLUMNS))
+db.prepare('api_genres', '''
+    SELECT genre_id, name, COUNT(show_id) AS total
+    FROM genres NATURAL JOIN types
+    GROUP BY genre_id
+    ORDER BY genre_id
+''')
+db.prepare('api_companies', '''
+    SELECT producer_id, name, COUNT(show_id) AS total
+    FROM companies NATURAL JOIN production
+    GROUP BY producer_id
+    ORDER BY producer_id
+''')
+
+@API.route('/shows/')
+def api_shows():
+    return stream('api_shows')
+
+# mesmos filtros que /shows/ (?genre=Drama&year_min=2010&...), com as contagens
+@API.route('/shows/facets/')
+def api_show_facets():
+    sort = request.args.get('sort', 'title')
+    if sort not in SHOW_SORTS:
+        return jsonify(error='Ordenação {} não existe.'.format(sort)), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    search = request.args.get('search', '').lower()
+
+    movies, page, total, counts = filtered_shows(sort, page, search, facet_filters())
+    result = {}
+    for name, options in counts.items():
+        if facets.FACETS[name][1] is None:
+            result[name] = [{'value': value, 'count': count} for value, count in options]
+        else:
+            result[name] = [{'min': low, 'max': high, 'count': count} for low, high, count in options]
+    return jsonify(total=total, page=page, total_pages=ceil(total / ITEMS_PER_PAGE),
+                   shows=[{k: row[k] for k in ('show_id', 'title', 'sort_value')} for row in movies],
+                   facets=result)
+
+@API.route('/shows/<int:id>/')
+def api_show(id):
+    movie, groups = show_detail(id)
+
+    if movie is None:
+        return not_found('Show id {} não existe.'.format(id))
+
+    show = {k: movie[k] for k in movie.keys() if k != 'has_scores'}
+    show['genres'] = [row['name'] for row in groups['genre']]
+    for role in SHOW_ROLES[1:]:
+        key = 'producer_id' if role == 'producer' else 'person_id'
+        show[role + 's'] = [{key: row[key], 'name': row['name']} for row in groups[role]]
+    show['similar'] = [dict(row) for row in groups['similar']]
+
+    return jsonify(show)
+
+@API.route('/people/')
+def api_people():
+    return stream('api_people')
+
+@API.route('/people/<int:id>/')
+def api_person(id):
+    person = db.query('person', [id]).fetchone()
+
+    if person is None:
+        return not_found('Person id {} não existe.'.format(id))
+
+    shows = db.query('person_shows', [id]).fetchall()
+    return jsonify(dict(person, shows=[dict(row) for row in shows]))
+
+@API.route('/people/<int:id>/collaborators/')
+def api_collaborators(id):
+    if db.query('person', [id]).fetchone() is None:
+        return not_found('Person id {} não existe.'.format(id))
+
+    limit = min(max(request.args.get('limit', COLLABORATORS, type=int), 1), MAX_COLLABORATORS)
+    rows = db.query('person_collaborators', [id, limit]).fetchall()
+    return jsonify([dict(row) for row in rows])
+
+@API.route('/genres/')
+def api_genres():
+    return stream('api_genres')
+
+@API.route('/genres/<int:id>/')
+def api_genre(id):
+    info = db.query('genre_info', [id]).fetchone()
+
+    if info['genre_name'] is None:
+        return not_found('Genre id {} não existe.'.format(id))
+
+    shows = db.query('genre_shows', [id]).fetchall()
+    return jsonify(genre_id=id, name=info['genre_name'], total=info['total'],
+                   shows=[dict(row) for row in shows])
+
+@API.route('/companies/')
+def api_companies():
+    return stream('api_companies')
+
+@API.route('/companies/<int:id>/')
+def api_company(id):
+    info = db.query('producer_info', [id]).fetchone()
+
+    if info['producer_name'] is None:
+        return not_found('Company id {} não existe.'.format(id))
+
+    shows = db.query('producer_shows', [id]).fetchall()
+    return jsonify(producer_id=id, name=info['producer_name'], total=info['total'],
+                   shows=[dict(row) for row in shows])
+
+@API.route('/faq/')
+def api_questions():
+    return jsonify([{'name': name, 'question': question} for name, question in faq.QUESTIONS])
+
+@API.route('/faq/<name>/')
+def api_faq(name):
+    if name not in faq.QUERIES:
+        return not_found('Pergunta {} não existe.'.format(name))
 
+    return stream(*faq_query(name))
 
+APP.register_blueprint(API)
 
+# Ponto de entrada WSGI (server.py, gunicorn 'app:create_app()'): cada processo
+# abre as suas ligações depois do fork, nunca as herda do processo pai; a cópia
+# em memória (snapshot.load), essa, é carregada antes do fork e partilhada
+def create_app(pool_size=db.POOL_SIZE, heavy_limit=HEAVY_LIMIT, snapshot=None):
+    db.connect(pool_size)
+    db.SNAPSHOT = snapshot
+    HEAVY['slots'] = threading.BoundedSemaphore(heavy_limit)
+    return APP
@@ -0,0 +1,254 @@
+#! /usr/bin/python3
+import argparse
+import html
+import json
+import os
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from math import ceil
+from urllib.parse import urlsplit
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(description="Mede a construção da BD e todas as rotas do app.py "
+                                             "com o CSV original e cópias ampliadas")
+parser.add_argument("--csv", default=os.path.join(HERE, "tv_shows.csv"))
+parser.add_argument("--scales", default="1,10",
+                    help="tamanhos a medir, em cópias do CSV (ex.: 1,10,100)")
+parser.add_argument("--requests", type=int, default=50, help="pedidos medidos por rota")
+parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "metacritic-bench"),
+                    help="onde ficam os CSVs ampliados e as BDs (reutilizados entre corridas)")
+parser.add_argument("--output", default="bench.json")
+parser.add_argument("--snapshot", action="store_true",
+                    help="mede as rotas servidas da cópia em memória (server.py --snapshot)")
+parser.add_argument("--routes", metavar="DIR", help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+#colunas com listas de nomes: em cada cópia os nomes levam um sufixo, para que
+#pessoas, produtoras e ligações também cresçam (os géneros ficam iguais)
+NAME_COLUMNS = ["production_companies", "created_by", "director", "writer", "top_cast"]
+
+def scaled_csv(scale, path):
+    df = pd.read_csv(args.csv)
+    step = df["id"].max() - df["id"].min() + 1
+    copies = [df]
+    for k in range(1, scale):
+        copy = df.copy()
+        copy["id"] += k * step
+        for col in NAME_COLUMNS:
+            copy[col] = copy[col].str.split(",").map(
+                lambda names: ",".join("{} #{}".format(n.strip(), k) for n in names),
+                na_action="ignore")
+        copies.append(copy)
+    pd.concat(copies).to_csv(path, index=False)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+#build num processo à parte: tempo total e pico de memória (ru_maxrss) do filho
+def build(directory, csv):
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "create_bd.py"), csv],
+                            cwd=directory, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        sys.exit("create_bd.py failed in {}".format(directory))
+    seconds = time.perf_counter() - start
+    with sqlite3.connect(os.path.join(directory, "Metacritic.db")) as conn:
+        counts = {t: conn.execute("SELECT COUNT(*) FROM " + t).fetchone()[0]
+                  for t in ("shows", "people", "production", "person_roles")}
+    conn.close()
+    return {"seconds": round(seconds, 3),
+            "peak_rss_kb": usage.ru_maxrss,
+            "db_bytes": os.path.getsize(os.path.join(directory, "Metacritic.db")),
+            "rows": counts}
+
+#ids espalhados pela tabela, para os detalhes não caírem sempre nas mesmas páginas
+def sample_ids(conn, table, column, n=10):
+    total = conn.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+    return [conn.execute("SELECT {c} FROM {t} ORDER BY {c} LIMIT 1 OFFSET ?".format(c=column, t=table),
+                         (total * i // n,)).fetchone()[0] for i in range(n)]
+
+#links "Next" seguidos a partir da primeira página de cada ordenação
+def keyset_urls(client, start, pages=5):
+    urls, url = [], start
+    for _ in range(pages):
+        with client.get(url) as r:
+            found = re.search(r'href="([^"]*after=[^"]*)"', r.get_data(as_text=True))
+        if not found:
+            break
+        url = html.unescape(found.group(1))
+        urls.append(url)
+    return urls
+
+def route_cases(client, conn):
+    last = lambda table: ceil(conn.execute("SELECT COUNT(*) FROM " + table).fetchone()[0] / 100)
+    shows = sample_ids(conn, "shows", "show_id")
+    people = sample_ids(conn, "people", "person_id")
+    companies = sample_ids(conn, "companies", "producer_id")
+    genres = [r[0] for r in conn.execute("SELECT genre_id FROM genres ORDER BY genre_id")]
+    faq = ["p{}".format(i) for i in range(1, 14)]
+
+    cases = {
+        "index": ["/"],
+        "shows": ["/shows/"],
+        "shows_search": ["/shows/?search=the", "/shows/?search=love", "/shows/?search=zzz"],
+        "shows_deep_page": ["/shows/?page={}".format(last("shows"))],
+        "shows_sorted": ["/shows/?sort=" + s for s in ("releaseDate", "metascore", "userscore")],
+        "shows_keyset": [],
+        "shows_facets": ["/shows/?genre=Drama", "/shows/?genre=Drama&genre=Comedy&year_min=2010&sort=metascore",
+                         "/shows/?rating=TV-MA&metascore_min=80&page=2", "/shows/?search=the&seasons_max=2"],
+        "show": ["/shows/{}/".format(i) for i in shows],
+        "genres": ["/genres/", "/genres/?search=dra"],
+        "genre": ["/genres/{}/".format(i) for i in genres],
+        "companies": ["/production-companies/", "/production-companies/?search=bbc"],
+        "companies_deep_page": ["/production-companies/?page={}".format(last("companies"))],
+        "company": ["/production-companies/{}/".format(i) for i in companies],
+        "people": ["/people/", "/people/?search=john"],
+        "people_deep_page": ["/people/?page={}".format(last("people"))],
+        "person": ["/person/{}/".format(i) for i in people],
+        "search": ["/search/?q=love", "/search/?q=bbc", "/search/?q=david"],
+        "faq": ["/faq/"],
+        "api_shows": ["/api/v1/shows/"],
+        "api_show_facets": ["/api/v1/shows/facets/?genre=Comedy&userscore_min=70",
+                            "/api/v1/shows/facets/?year_min=2000&year_max=2009&sort=userscore"],
+        "api_show": ["/api/v1/shows/{}/".format(i) for i in shows],
+        "api_people": ["/api/v1/people/"],
+        "api_person": ["/api/v1/people/{}/".format(i) for i in people],
+        "api_collaborators": ["/api/v1/people/{}/collaborators/".format(i) for i in people],
+        "api_genres": ["/api/v1/genres/"],
+        "api_genre": ["/api/v1/genres/{}/".format(i) for i in genres],
+        "api_companies": ["/api/v1/companies/"],
+        "api_company": ["/api/v1/companies/{}/".format(i) for i in companies],
+        "api_faq_list": ["/api/v1/faq/"],
+    }
+    for sort in ("title", "releaseDate", "metascore"):
+        cases["shows_keyset"] += keyset_urls(client, "/shows/?sort=" + sort)
+    for name in faq:
+        cases["faq_" + name] = ["/faq/{}/".format(name)]
+        cases["api_faq_" + name] = ["/api/v1/faq/{}/".format(name)]
+    cases["faq_p7_live"] = ["/faq/p7/?size=3", "/faq/p7/?size=4&gap=5"]
+    return cases
+
+#corre dentro de um processo novo (um por tamanho), já na pasta da BD
+def measure_routes(directory):
+    os.chdir(directory)
+    sys.path.insert(0, HERE)
+    import db
+    #sem cache de resultados: cada pedido mede a query, não o dicionário
+    db.CACHE_SIZE = 0
+    opened, open_db = [], db._open
+    def tracked():
+        c = open_db()
+        opened.append(c)
+        return c
+    db._open = tracked
+    from app import APP, create_app
+    snap = None
+    if args.snapshot:
+        import snapshot
+        snap = snapshot.load(db.DB_FILE)
+    create_app(snapshot=snap)
+    client = APP.test_client()
+    conn = sqlite3.connect("Metacritic.db")
+    cases = route_cases(client, conn)
+    conn.close()
+
+    adapter = APP.url_map.bind("localhost")
+    covered = {adapter.match(urlsplit(u).path)[0] for urls in cases.values() for u in urls}
+    uncovered = sorted(r.endpoint for r in APP.url_map.iter_rules()
+                       if r.endpoint not in covered and r.endpoint != "static")
+
+    #"linhas lidas": o SQLite não expõe esse número por query, por isso conta-se
+    #instruções da máquina virtual (em blocos de 100) numa passagem à parte, sem tempo
+    steps = [0]
+    def tick():
+        steps[0] += 1
+        return 0
+
+    results = {}
+    for name, urls in cases.items():
+        if not urls:
+            continue
+        for u in urls:
+            with client.get(u) as r:
+                r.get_data()
+        times, status, size = [], {}, 0
+        for i in range(args.requests):
+            u = urls[i % len(urls)]
+            start = time.perf_counter()
+            with client.get(u) as r:
+                body = r.get_data()
+            times.append((time.perf_counter() - start) * 1000)
+            status[r.status_code] = status.get(r.status_code, 0) + 1
+            size += len(body)
+        for c in opened:
+            c.set_progress_handler(tick, 100)
+        steps[0] = 0
+        for u in urls:
+            with client.get(u) as r:
+                r.get_data()
+        for c in opened:
+            c.set_progress_handler(None, 0)
+        results[name] = {
+            "urls": len(urls),
+            "requests": args.requests,
+            "status": status,
+            "p50_ms": round(percentile(times, 50), 3),
+            "p95_ms": round(percentile(times, 95), 3),
+            "p99_ms": round(percentile(times, 99), 3),
+            "sqlite_vm_steps": steps[0] * 100 // len(urls),
+            "avg_bytes": size // args.requests,
+        }
+    db.close()
+    json.dump({"routes": results, "uncovered": uncovered,
+               "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+              sys.stdout)
+
+if args.routes:
+    measure_routes(args.routes)
+    sys.exit()
+
+report = {"csv": args.csv, "requests_per_route": args.requests, "snapshot": args.snapshot,
+          "scales": {}}
+for scale in [int(s) for s in args.scales.split(",")]:
+    directory = os.path.join(args.workdir, "x{}".format(scale))
+    os.makedirs(directory, exist_ok=True)
+    csv = args.csv
+    if scale > 1:
+        csv = os.path.join(directory, "tv_shows.csv")
+        if not os.path.exists(csv):
+            scaled_csv(scale, csv)
+
+    print("{}x: building...".format(scale), file=sys.stderr)
+    result = {"build": build(directory, csv)}
+    print("{}x: measuring routes...".format(scale), file=sys.stderr)
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--routes", directory,
+                          "--requests", str(args.requests)] + ["--snapshot"] * args.snapshot,
+                         stdout=subprocess.PIPE, check=True).stdout
+    result.update(json.loads(out.decode().splitlines()[-1]))
+    report["scales"][str(scale)] = result
+
+    b = result["build"]
+    print("\n{}x: build {:.1f}s, peak RSS {} MB, DB {} MB, {} shows, {} people".format(
+        scale, b["seconds"], b["peak_rss_kb"] // 1024, b["db_bytes"] // 2**20,
+        b["rows"]["shows"], b["rows"]["people"]))
+    if result["uncovered"]:
+        print("  WARNING: routes without cases: " + ", ".join(result["uncovered"]))
+    print("  {:<22}{:>10}{:>10}{:>10}{:>14}".format("route", "p50 ms", "p95 ms", "p99 ms", "VM steps"))
+    for name, r in result["routes"].items():
+        print("  {:<22}{:>10.2f}{:>10.2f}{:>10.2f}{:>14}".format(
+            name, r["p50_ms"], r["p95_ms"], r["p99_ms"], r["sqlite_vm_steps"]))
+    print("  routes peak RSS {} MB".format(result["peak_rss_kb"] // 1024))
+
+with open(args.output, "w") as f:
+    json.dump(report, f, indent=2)
+print("\nwrote " + args.output)
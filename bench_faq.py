@@ -0,0 +1,102 @@
+#! /usr/bin/python3
+import argparse
+import sqlite3
+import statistics
+import time
+import faq
+
+parser = argparse.ArgumentParser(description="Compara as queries antigas e novas da FAQ (p8, p9, p10)")
+parser.add_argument("--db", default="Metacritic.db")
+parser.add_argument("--scale", type=int, default=10,
+                    help="quantas cópias de cada show (e das suas ligações) usar")
+parser.add_argument("--repeat", type=int, default=3)
+args = parser.parse_args()
+
+#versões anteriores: juntam todas as tabelas de papéis ao mesmo tempo
+LEGACY = {
+    "p8": """
+        SELECT DISTINCT s.title, p.name
+        FROM shows s
+        LEFT JOIN directors d ON s.show_id = d.show_id
+        LEFT JOIN writers w ON s.show_id = w.show_id
+        LEFT JOIN creators c ON s.show_id = c.show_id
+        LEFT JOIN top_cast tc ON s.show_id = tc.show_id
+        LEFT JOIN people p ON p.person_id = COALESCE(d.person_id, w.person_id, c.person_id, tc.person_id)
+        WHERE (d.person_id IS NOT NULL AND w.person_id = d.person_id)
+           OR (d.person_id IS NOT NULL AND tc.person_id = d.person_id)
+           OR (d.person_id IS NOT NULL AND c.person_id = d.person_id)
+           OR (w.person_id IS NOT NULL AND tc.person_id = w.person_id)
+           OR (w.person_id IS NOT NULL AND c.person_id = w.person_id)
+        ORDER BY s.title
+    """,
+    "p9": """
+        SELECT s.title,
+               COUNT(DISTINCT d.person_id) +
+               COUNT(DISTINCT w.person_id) +
+               COUNT(DISTINCT c.person_id) AS total_people
+        FROM shows s
+        LEFT JOIN directors d ON s.show_id = d.show_id
+        LEFT JOIN writers w ON s.show_id = w.show_id
+        LEFT JOIN creators c ON s.show_id = c.show_id
+        GROUP BY s.title
+        ORDER BY total_people DESC
+        LIMIT 100
+    """,
+    "p10": """
+        SELECT s.title,
+               COUNT(DISTINCT d.person_id) +
+               COUNT(DISTINCT w.person_id) +
+               COUNT(DISTINCT c.person_id) AS total_people
+        FROM shows s
+        LEFT JOIN directors d ON s.show_id = d.show_id
+        LEFT JOIN writers w ON s.show_id = w.show_id
+        LEFT JOIN creators c ON s.show_id = c.show_id
+        GROUP BY s.title
+        HAVING total_people > 0
+        ORDER BY total_people
+        LIMIT 100
+    """,
+}
+
+SHOW_TABLES = ["shows", "metascore", "userscore", "types", "production",
+               "directors", "writers", "top_cast", "creators"]
+
+#cópia em memória com cada show repetido 'scale' vezes (ids deslocados);
+#as pessoas são as mesmas, por isso cada show mantém o mesmo número de ligações
+def scaled_copy(path, scale):
+    conn = sqlite3.connect(":memory:")
+    src = sqlite3.connect(path)
+    src.backup(conn)
+    src.close()
+
+    low, high = conn.execute("SELECT MIN(show_id), MAX(show_id) FROM shows").fetchone()
+    step = high - low + 1
+    for table in SHOW_TABLES:
+        columns = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+        select = ", ".join(f"{c} + ?" if c == "show_id" else c for c in columns)
+        for k in range(1, scale):
+            conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {select} FROM {table} "
+                         f"WHERE show_id <= ?", (k * step, high))
+    conn.execute("ANALYZE")
+    conn.commit()
+    return conn
+
+def timed(conn, sql):
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        rows = conn.execute(sql).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), len(rows)
+
+conn = scaled_copy(args.db, args.scale)
+shows, links = conn.execute("SELECT (SELECT COUNT(*) FROM shows), (SELECT COUNT(*) FROM top_cast) + "
+                            "(SELECT COUNT(*) FROM directors) + (SELECT COUNT(*) FROM writers) + "
+                            "(SELECT COUNT(*) FROM creators)").fetchone()
+print("{}x: {} shows, {} role links (median of {} runs)".format(args.scale, shows, links, args.repeat))
+print("{:<6}{:>12}{:>12}{:>10}".format("query", "before ms", "after ms", "speedup"))
+for name, sql in LEGACY.items():
+    before, _ = timed(conn, sql)
+    after, _ = timed(conn, faq.QUERIES[name])
+    print("{:<6}{:>12.1f}{:>12.1f}{:>9.1f}x".format(name, before * 1000, after * 1000, before / after))
+conn.close()
@@ -0,0 +1,105 @@
+# Rede de colaborações: para cada par de pessoas que trabalharam no mesmo show,
+# o nº de shows em comum e os papéis do colaborador nesses shows. O create_bd.py
+# calcula-a a partir de person_roles e guarda-a na tabela collaborations (as
+# duas direções de cada par), que o site lê diretamente.
+import numpy as np
+
+ROLES = ["actor", "creator", "director", "writer"]
+
+# papéis de uma pessoa (bits pela ordem de ROLES) no formato de people.roles
+ROLE_NAMES = [", ".join(r for i, r in enumerate(ROLES) if bits >> i & 1)
+              for bits in range(1 << len(ROLES))]
+
+# Pares calculados de cada vez (o custo total é a soma, por show, do quadrado
+# do nº de pessoas, não o quadrado do nº de pessoas)
+BLOCK_PAIRS = 2 ** 22
+
+LINKS = """
+    SELECT show_id, person_id, SUM(DISTINCT CASE role {} END)
+    FROM person_roles
+    GROUP BY person_id, show_id
+""".format(" ".join("WHEN '{}' THEN {}".format(r, 1 << i) for i, r in enumerate(ROLES)))
+
+SCHEMA = """
+    CREATE TABLE collaborations(
+        person_a         INTEGER NOT NULL,
+        person_b         INTEGER NOT NULL,
+        shared_shows     INTEGER NOT NULL,
+        roles            VARCHAR(50) NOT NULL,
+        PRIMARY KEY (person_a, person_b),
+        FOREIGN KEY (person_a) REFERENCES people(person_id),
+        FOREIGN KEY (person_b) REFERENCES people(person_id)
+    ) WITHOUT ROWID
+"""
+
+# Produto da matriz de incidência pessoa x show pela sua transposta, feito par a
+# par: cada ligação (pessoa, show) junta-se às outras pessoas do mesmo show.
+# Devolve, por blocos de pessoas (só as de 'people', se indicado) e por ordem de
+# (a, b): a, b, shows em comum, papéis de b e papéis de a nesses shows
+def pairs(links, people=None):
+    links = links[np.lexsort((links[:, 1], links[:, 0]))]
+    show, person, bits = links.T
+    start = np.searchsorted(show, show)
+    size = np.searchsorted(show, show, side="right") - start
+    width = int(person.max()) + 1 if len(person) else 1
+
+    by_person = np.argsort(person, kind="stable")
+    if people is not None:
+        by_person = by_person[np.isin(person[by_person], list(people))]
+    work = np.cumsum(size[by_person])
+    sorted_people = person[by_person]
+
+    lo = 0
+    while lo < len(by_person):
+        done = work[lo - 1] if lo else 0
+        hi = max(lo + 1, np.searchsorted(work, done + BLOCK_PAIRS, side="right"))
+        #o bloco acaba no fim de uma pessoa
+        hi = np.searchsorted(sorted_people, sorted_people[hi - 1], side="right")
+        entries = by_person[lo:hi]
+        lo = hi
+
+        sizes = size[entries]
+        partner = np.repeat(start[entries] - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        a = np.repeat(person[entries], sizes)
+        keep = a != person[partner]
+        if not keep.any():
+            continue
+        key = a[keep] * width + person[partner][keep]
+        bits_b = bits[partner][keep]
+        bits_a = np.repeat(bits[entries], sizes)[keep]
+
+        order = np.argsort(key, kind="stable")
+        key, bits_b, bits_a = key[order], bits_b[order], bits_a[order]
+        first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        yield (key[first] // width, key[first] % width, np.diff(np.r_[first, len(key)]),
+               np.bitwise_or.reduceat(bits_b, first), np.bitwise_or.reduceat(bits_a, first))
+
+def load_links(cur):
+    return np.array(cur.execute(LINKS).fetchall(), dtype=np.int64).reshape(-1, 3)
+
+def rows(a, b, shared, bits):
+    return zip(a.tolist(), b.tolist(), shared.tolist(), [ROLE_NAMES[i] for i in bits.tolist()])
+
+INSERT = "INSERT INTO collaborations (person_a, person_b, shared_shows, roles) VALUES (?, ?, ?, ?)"
+
+#só com execute: no modo incremental corre dentro da transação do create_bd.py
+def materialize(cur):
+    links = load_links(cur)
+    cur.execute("DROP TABLE IF EXISTS collaborations")
+    cur.execute(SCHEMA)
+    for a, b, shared, bits_b, _ in pairs(links):
+        cur.executemany(INSERT, rows(a, b, shared, bits_b))
+
+#sincronização incremental: só as pessoas dos shows alterados mudam de colaboradores
+def update(cur, people):
+    people = set(people)
+    for person in people:
+        others = [(b, person) for b, in cur.execute(
+            "SELECT person_b FROM collaborations WHERE person_a = ?", (person,)).fetchall()]
+        cur.executemany("DELETE FROM collaborations WHERE person_a = ? AND person_b = ?", others)
+        cur.execute("DELETE FROM collaborations WHERE person_a = ?", (person,))
+    for a, b, shared, bits_b, bits_a in pairs(load_links(cur), people):
+        cur.executemany(INSERT, rows(a, b, shared, bits_b))
+        #a direção inversa dos pares com alguém que não foi recalculado
+        mirror = ~np.isin(b, list(people))
+        cur.executemany(INSERT, rows(b[mirror], a[mirror], shared[mirror], bits_a[mirror]))
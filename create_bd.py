@@ -1,13 +1,28 @@
 import sqlite3
 import pandas as pd
-import math
-
-df = pd.read_csv("tv_shows.csv")
-df = df.rename(columns={"id": "show_id"})
-conn = sqlite3.connect("Metacritic.db")
-cur = conn.cursor()
-
-cur.executescript("""
+import argparse
+import os
+import re
+import sys
+import time
+import unicodedata
+import uuid
+import collaborations
+import faq
+import similar
+
+DB_FILE = "Metacritic.db"
+BUILD_FILE = DB_FILE + ".build"
+
+parser = argparse.ArgumentParser(description="Constrói o Metacritic.db a partir do CSV")
+parser.add_argument("csv", nargs="?", default="tv_shows.csv")
+parser.add_argument("--chunksize", type=int, default=100000,
+                    help="linhas do CSV lidas de cada vez (limita a memória usada)")
+parser.add_argument("--incremental", action="store_true",
+                    help="aplica à BD existente só os shows novos, alterados ou removidos")
+args = parser.parse_args()
+
+SCHEMA = """
     DROP TABLE IF EXISTS genres;
     DROP TABLE IF EXISTS companies;
     DROP TABLE IF EXISTS people;
@@ -20,20 +35,23 @@ cur.executescript("""
     DROP TABLE IF EXISTS writers;
     DROP TABLE IF EXISTS top_cast;
     DROP TABLE IF EXISTS creators;
+    DROP TABLE IF EXISTS show_hashes;
+    DROP TABLE IF EXISTS metadata;
 
     CREATE TABLE genres(
         genre_id         INTEGER PRIMARY KEY AUTOINCREMENT,
-        name             VARCHAR(50) NOT NULL   
+        name             VARCHAR(50) NOT NULL UNIQUE
     );
 
     CREATE TABLE companies(
         producer_id      INTEGER PRIMARY KEY AUTOINCREMENT,
-        name             VARCHAR(50) NOT NULL   
+        name             VARCHAR(50) NOT NULL UNIQUE
     );
 
     CREATE TABLE people(
         person_id        INTEGER PRIMARY KEY AUTOINCREMENT,
-        name             VARCHAR(100) NOT NULL   
+        name             VARCHAR(100) NOT NULL UNIQUE,
+        roles            VARCHAR(50)
     );
 
     CREATE TABLE metascore(
@@ -61,6 +79,16 @@ cur.executescript("""
         FOREIGN KEY (show_id) REFERENCES userscore(show_id)
     );
 
+    CREATE TABLE show_hashes(
+        show_id          INTEGER PRIMARY KEY,
+        hash             INTEGER NOT NULL
+    );
+
+    CREATE TABLE metadata(
+        key              VARCHAR(30) PRIMARY KEY,
+        value            VARCHAR(100) NOT NULL
+    );
+
     CREATE TABLE types(
         show_id          INTEGER NOT NULL,
         genre_id         INTEGER NOT NULL,
@@ -108,115 +136,429 @@ cur.executescript("""
         FOREIGN KEY (show_id) REFERENCES shows(show_id),
         FOREIGN KEY (person_id) REFERENCES people(person_id)
     );
-""")
+"""
+
+#índices secundários: procuras inversas nas tabelas de ligação e nomes/títulos
+INDEXES = """
+    CREATE INDEX idx_types_genre        ON types(genre_id, show_id);
+    CREATE INDEX idx_production_company ON production(producer_id, show_id);
+    CREATE INDEX idx_directors_person   ON directors(person_id, show_id);
+    CREATE INDEX idx_writers_person     ON writers(person_id, show_id);
+    CREATE INDEX idx_top_cast_person    ON top_cast(person_id, show_id);
+    CREATE INDEX idx_creators_person    ON creators(person_id, show_id);
+
+    CREATE INDEX idx_shows_title        ON shows(title);
+    CREATE INDEX idx_shows_release      ON shows(releaseDate);
+
+    CREATE INDEX idx_shows_release_sort ON shows(IFNULL(CAST(releaseDate AS TEXT), ''));
+    CREATE INDEX idx_metascore_sort     ON metascore(IFNULL(metascore, -1));
+    CREATE INDEX idx_userscore_sort     ON userscore(IFNULL(userscore, -1));
+"""
+
+#papéis de cada pessoa numa só tabela, com índices nos dois sentidos, e o seu
+#resumo em people.roles; os triggers mantêm ambos quando o --incremental altera
+#as tabelas de papéis
+PERSON_ROLE_TABLES = [("top_cast", "actor"), ("creators", "creator"),
+                      ("directors", "director"), ("writers", "writer")]
+
+PERSON_ROLES_SUMMARY = """
+    (SELECT REPLACE(GROUP_CONCAT(role), ',', ', ') FROM (
+        SELECT DISTINCT role FROM person_roles r WHERE r.person_id = {} ORDER BY role))
+"""
+
+PERSON_ROLES = """
+    DROP TABLE IF EXISTS person_roles;
+
+    CREATE TABLE person_roles(
+        person_id        INTEGER NOT NULL,
+        show_id          INTEGER NOT NULL,
+        role             VARCHAR(10) NOT NULL,
+        PRIMARY KEY (person_id, show_id, role),
+        FOREIGN KEY (person_id) REFERENCES people(person_id),
+        FOREIGN KEY (show_id) REFERENCES shows(show_id)
+    );
 
+    INSERT INTO person_roles (person_id, show_id, role)
+    SELECT person_id, show_id, role FROM ({roles});
+
+    CREATE INDEX idx_person_roles_show ON person_roles(show_id);
+
+    UPDATE people SET roles = {summary};
+
+    CREATE TRIGGER person_roles_ai AFTER INSERT ON person_roles BEGIN
+        UPDATE people SET roles = {new_summary} WHERE person_id = new.person_id;
+    END;
+    CREATE TRIGGER person_roles_ad AFTER DELETE ON person_roles BEGIN
+        UPDATE people SET roles = {old_summary} WHERE person_id = old.person_id;
+    END;
+""".format(roles=faq.ROLES, summary=PERSON_ROLES_SUMMARY.format("people.person_id"),
+           new_summary=PERSON_ROLES_SUMMARY.format("new.person_id"),
+           old_summary=PERSON_ROLES_SUMMARY.format("old.person_id")) + "".join(f"""
+    CREATE TRIGGER {table}_roles_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO person_roles (person_id, show_id, role) VALUES (new.person_id, new.show_id, '{role}');
+    END;
+    CREATE TRIGGER {table}_roles_ad AFTER DELETE ON {table} BEGIN
+        DELETE FROM person_roles
+        WHERE person_id = old.person_id AND show_id = old.show_id AND role = '{role}';
+    END;
+""" for table, role in PERSON_ROLE_TABLES)
+
+#índices de pesquisa (FTS5) sobre shows, people e companies
+#os triggers mantêm-nos sincronizados com as tabelas de origem
+SEARCH_INDEXES = """
+    DROP TABLE IF EXISTS shows_fts;
+    DROP TABLE IF EXISTS people_fts;
+    DROP TABLE IF EXISTS companies_fts;
+
+    CREATE VIRTUAL TABLE shows_fts USING fts5(
+        title, description, tagline,
+        content='shows', content_rowid='show_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
 
-#coloca os dados na tabela shows
-df[["show_id", "title", "releaseDate", "rating", "description", "duration",
-    "num_seasons", "tagline"]].to_sql("shows", conn, if_exists="append", index = False)
+    CREATE VIRTUAL TABLE people_fts USING fts5(
+        name,
+        content='people', content_rowid='person_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
 
-#coloca os dados na tabela metascore
-df[["show_id", "metascore", "metascore_count"]].to_sql("metascore", conn, if_exists="append", index = False)
+    CREATE VIRTUAL TABLE companies_fts USING fts5(
+        name,
+        content='companies', content_rowid='producer_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
 
-#userscore
-df[["show_id", "userscore", "userscore_count"]].to_sql("userscore", conn, if_exists="append", index = False)
+    INSERT INTO shows_fts(shows_fts) VALUES ('rebuild');
+    INSERT INTO people_fts(people_fts) VALUES ('rebuild');
+    INSERT INTO companies_fts(companies_fts) VALUES ('rebuild');
+
+    CREATE TRIGGER shows_fts_ai AFTER INSERT ON shows BEGIN
+        INSERT INTO shows_fts(rowid, title, description, tagline)
+        VALUES (new.show_id, new.title, new.description, new.tagline);
+    END;
+    CREATE TRIGGER shows_fts_ad AFTER DELETE ON shows BEGIN
+        INSERT INTO shows_fts(shows_fts, rowid, title, description, tagline)
+        VALUES ('delete', old.show_id, old.title, old.description, old.tagline);
+    END;
+    CREATE TRIGGER shows_fts_au AFTER UPDATE ON shows BEGIN
+        INSERT INTO shows_fts(shows_fts, rowid, title, description, tagline)
+        VALUES ('delete', old.show_id, old.title, old.description, old.tagline);
+        INSERT INTO shows_fts(rowid, title, description, tagline)
+        VALUES (new.show_id, new.title, new.description, new.tagline);
+    END;
+
+    CREATE TRIGGER people_fts_ai AFTER INSERT ON people BEGIN
+        INSERT INTO people_fts(rowid, name) VALUES (new.person_id, new.name);
+    END;
+    CREATE TRIGGER people_fts_ad AFTER DELETE ON people BEGIN
+        INSERT INTO people_fts(people_fts, rowid, name) VALUES ('delete', old.person_id, old.name);
+    END;
+    CREATE TRIGGER people_fts_au AFTER UPDATE OF name ON people BEGIN
+        INSERT INTO people_fts(people_fts, rowid, name) VALUES ('delete', old.person_id, old.name);
+        INSERT INTO people_fts(rowid, name) VALUES (new.person_id, new.name);
+    END;
+
+    CREATE TRIGGER companies_fts_ai AFTER INSERT ON companies BEGIN
+        INSERT INTO companies_fts(rowid, name) VALUES (new.producer_id, new.name);
+    END;
+    CREATE TRIGGER companies_fts_ad AFTER DELETE ON companies BEGIN
+        INSERT INTO companies_fts(companies_fts, rowid, name) VALUES ('delete', old.producer_id, old.name);
+    END;
+    CREATE TRIGGER companies_fts_au AFTER UPDATE ON companies BEGIN
+        INSERT INTO companies_fts(companies_fts, rowid, name) VALUES ('delete', old.producer_id, old.name);
+        INSERT INTO companies_fts(rowid, name) VALUES (new.producer_id, new.name);
+    END;
+"""
+
+#converte um DataFrame em tuplos para o executemany (NaN -> NULL)
+def to_rows(frame):
+    return frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+
+#uma linha (show_id, name) por cada nome de uma coluna com listas separadas por vírgulas
+def explode_names(df, colname):
+    names = df.set_index("show_id")[colname].dropna().astype(str).str.split(",").explode().str.strip()
+    return names[names != ""].rename("name").reset_index()
+
+#chave de comparação dos nomes: sem diferenças de maiúsculas, acentos, formas
+#Unicode equivalentes ou espaços repetidos ("Fox"/"FOX", "Vídeo"/"Video").
+#Só se tiram os acentos de letras latinas: noutras escritas as marcas distinguem
+#nomes diferentes (em japonês ガ não é カ)
+def name_key(name):
+    chars = []
+    latin = False
+    for ch in unicodedata.normalize("NFKD", name):
+        if not unicodedata.combining(ch):
+            latin = unicodedata.name(ch, "").startswith("LATIN ")
+        elif latin:
+            continue
+        chars.append(ch)
+    return " ".join(unicodedata.normalize("NFKC", "".join(chars)).casefold().split())
+
+#chave do nome -> id de genres, companies e people; é o único estado que fica
+#em memória entre blocos do CSV
+IDS = {"genres": {}, "companies": {}, "people": {}}
+
+#devolve o id de cada nome, gravando na tabela os nomes ainda sem id
+#(ids 1..n pela ordem de aparecimento; fica a primeira grafia de cada chave)
+def resolve_ids(names, table, id_col):
+    ids = IDS[table]
+    keys = names.map({name: name_key(name) for name in pd.unique(names)})
+    new = pd.DataFrame({"key": keys, "name": names})[~keys.isin(ids.keys())].drop_duplicates("key")
+    next_id = cur.execute(f"SELECT COALESCE(MAX({id_col}), 0) + 1 FROM {table}").fetchone()[0]
+    rows = list(zip(range(next_id, next_id + len(new)), new["name"]))
+    cur.executemany(f"INSERT INTO {table} ({id_col}, name) VALUES (?, ?)", rows)
+    ids.update(zip(new["key"], range(next_id, next_id + len(new))))
+    return keys.map(ids)
+
+def insert_links(links, table, id_col):
+    cur.executemany(f"INSERT INTO {table} (show_id, {id_col}) VALUES (?, ?)",
+                    to_rows(links[["show_id", id_col]].drop_duplicates()))
+
+ROLES = [("director", "directors"), ("writer", "writers"),
+         ("top_cast", "top_cast"), ("created_by", "creators")]
+
+#grava um bloco do CSV em todas as tabelas de uma só passagem
+def load_chunk(df, hashes):
+    df = df.rename(columns={"id": "show_id"})
+
+    cur.executemany("INSERT INTO show_hashes (show_id, hash) VALUES (?, ?)",
+                    zip(df["show_id"].tolist(), hashes.tolist()))
+
+    #shows, metascore e userscore
+    cur.executemany("""
+        INSERT INTO shows (show_id, title, releaseDate, rating, description, duration, num_seasons, tagline)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, to_rows(df[["show_id", "title", "releaseDate", "rating", "description", "duration",
+                     "num_seasons", "tagline"]]))
+    cur.executemany("INSERT INTO metascore (show_id, metascore, metascore_count) VALUES (?, ?, ?)",
+                    to_rows(df[["show_id", "metascore", "metascore_count"]]))
+    cur.executemany("INSERT INTO userscore (show_id, userscore, userscore_count) VALUES (?, ?, ?)",
+                    to_rows(df[["show_id", "userscore", "userscore_count"]]))
+
+    #genres e types
+    types = explode_names(df, "genres")
+    types["genre_id"] = resolve_ids(types["name"], "genres", "genre_id")
+    insert_links(types, "types", "genre_id")
+
+    #companies e production
+    production = explode_names(df, "production_companies")
+    production["producer_id"] = resolve_ids(production["name"], "companies", "producer_id")
+    insert_links(production, "production", "producer_id")
+
+    #people, top_cast, writers, creators e directors
+    #uma pessoa tem o mesmo id em todos os papéis
+    roles = pd.concat([explode_names(df, colname).assign(link_table=link_table)
+                       for colname, link_table in ROLES], ignore_index=True)
+    roles["person_id"] = resolve_ids(roles["name"], "people", "person_id")
+
+    for _, link_table in ROLES:
+        insert_links(roles[roles["link_table"] == link_table], link_table, "person_id")
+
+COLUMNS = ["id", "title", "releaseDate", "rating", "genres", "description", "duration",
+           "tagline", "num_seasons", "metascore", "metascore_count", "userscore",
+           "userscore_count", "production_companies", "created_by", "director",
+           "writer", "top_cast"]
+
+#tipos fixos para que o hash de uma linha não dependa do bloco em que foi lida
+DTYPES = {c: "str" for c in COLUMNS}
+DTYPES.update({"id": "int64", "duration": "float64", "num_seasons": "float64",
+               "metascore": "float64", "metascore_count": "float64",
+               "userscore": "float64", "userscore_count": "float64"})
+
+def read_chunks(csv):
+    for chunk in pd.read_csv(csv, usecols=COLUMNS, dtype=DTYPES, chunksize=args.chunksize):
+        yield chunk, pd.util.hash_pandas_object(chunk[COLUMNS], index=False).to_numpy().view("int64")
+
+#verifica que as queries dos pedidos não fazem SCAN completo a tabelas grandes
+LARGE_TABLES = {"shows", "people", "companies", "metascore", "userscore", "types",
+                "production", "directors", "writers", "top_cast", "creators", "person_roles",
+                "similar_shows", "collaborations", "cast_signatures"}
+
+#contagens (estatísticas e total de páginas) têm de ver todas as linhas
+FULL_SCAN_OK = {"stats"} | {name + suffix for name in ("shows", "genres", "companies", "people")
+                            for suffix in ("_count", "_count_search")}
+#as coleções da API devolvem a tabela inteira
+FULL_SCAN_OK |= {"api_shows", "api_people", "api_genres", "api_companies"}
+#o índice das facetas (facets.py) lê tudo uma vez por build, tal como a pesquisa
+#de títulos que os filtros combinam com ele
+FULL_SCAN_OK |= {"facets_shows", "facets_genres", "shows_ids_search"}
+FULL_SCAN_OK |= {"shows_{}_order".format(sort) for sort in ("title", "releaseDate", "metascore", "userscore")}
+#a pesquisa por nome nas listas (LIKE '%...%') não tem índice que a sirva
+FULL_SCAN_OK |= {name + "_page_search" for name in ("genres", "companies", "people")}
+
+#percorrer um índice inteiro também é um SCAN completo; só é aceite nas listas
+#paginadas, em que o índice dá a ordem do ORDER BY e o LIMIT pára a leitura
+INDEX_SCAN_OK = {"shows_{}_offset{}".format(sort, suffix)
+                 for sort in ("title", "releaseDate", "metascore", "userscore") for suffix in ("", "_search")}
+INDEX_SCAN_OK |= {name + "_page" for name in ("genres", "companies", "people")}
+
+#queries das rotas, tal como registadas pelo app.py
+def route_queries():
+    import app, db
+    return [(name, sql, [1] * sql.count("?")) for name, sql in db.STATEMENTS.items()
+            if name not in FULL_SCAN_OK]
+
+#o EXPLAIN mostra o apelido (FROM shows s) e não a tabela: apelido -> tabela
+SQL_WORDS = {"WHERE", "JOIN", "NATURAL", "LEFT", "INNER", "CROSS", "ON", "USING", "GROUP",
+             "ORDER", "LIMIT", "UNION", "HAVING", "WINDOW", "AS"}
+
+def table_names(sql):
+    names = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.I):
+        names.setdefault(table, table)
+        if alias and alias.upper() not in SQL_WORDS:
+            names[alias] = table
+    return names
+
+def check_query_plans(cur, queries):
+    problems = []
+    for name, sql, args in queries:
+        tables = table_names(sql)
+        for row in cur.execute("EXPLAIN QUERY PLAN " + sql, args).fetchall():
+            detail = row[-1]
+            m = re.match(r"SCAN (\w+)", detail)
+            if not m or tables.get(m.group(1), m.group(1)) not in LARGE_TABLES:
+                continue
+            if re.search(r"USING (COVERING )?INDEX", detail) and name in INDEX_SCAN_OK:
+                continue
+            problems.append((" ".join(sql.split()), detail))
+    return problems
+
+#tabelas de ligação -> tabela de nomes e respetivo id
+LINKS = [("types", "genres", "genre_id"), ("production", "companies", "producer_id"),
+         ("directors", "people", "person_id"), ("writers", "people", "person_id"),
+         ("top_cast", "people", "person_id"), ("creators", "people", "person_id")]
+
+#apaga os shows e as suas ligações; devolve os ids de nomes que podem ter ficado sem uso
+def delete_shows(show_ids):
+    keys = [(i,) for i in show_ids]
+    orphans = {"genres": set(), "companies": set(), "people": set()}
+    for link_table, table, id_col in LINKS:
+        for key in keys:
+            orphans[table].update(r[0] for r in cur.execute(
+                f"SELECT {id_col} FROM {link_table} WHERE show_id = ?", key))
+        cur.executemany(f"DELETE FROM {link_table} WHERE show_id = ?", keys)
+    for table in ["metascore", "userscore", "show_hashes", "shows"]:
+        cur.executemany(f"DELETE FROM {table} WHERE show_id = ?", keys)
+    return orphans
+
+def delete_orphans(orphans):
+    for table, ids in orphans.items():
+        id_col = next(c for _, t, c in LINKS if t == table)
+        unused = " AND ".join(f"NOT EXISTS (SELECT 1 FROM {l} WHERE {l}.{id_col} = {table}.{id_col})"
+                              for l, t, _ in LINKS if t == table)
+        cur.executemany(f"DELETE FROM {table} WHERE {id_col} = ? AND {unused}", [(i,) for i in ids])
+
+#identificador desta versão dos dados: o site usa-o como ETag (ver app.py)
+def stamp_build():
+    cur.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                    [("build", uuid.uuid4().hex), ("built_at", str(int(time.time())))])
+
+#construção completa: a BD é criada num ficheiro à parte e só no fim substitui
+#a que está em uso, pelo que o site nunca vê uma BD a meio
+def build():
+    #durante a construção ninguém lê este ficheiro: sem fsync e com o journal em memória
+    cur.execute("PRAGMA synchronous=OFF")
+    cur.execute("PRAGMA journal_mode=MEMORY")
+    cur.executescript(SCHEMA)
+
+    for chunk, hashes in read_chunks(args.csv):
+        load_chunk(chunk, hashes)
+    conn.commit()
 
-#genres
-all_genres = (
-    df["genres"].str.split(",").explode().str.strip().unique()
-)
+    cur.executescript(INDEXES)
+    cur.executescript(PERSON_ROLES)
+    cur.executescript(SEARCH_INDEXES)
 
-for c in all_genres:
-    cur.execute("INSERT OR IGNORE INTO genres (name) VALUES (?)", (c,))
-conn.commit()
+    #estatísticas para o planeador de queries
+    cur.execute("ANALYZE")
+    conn.commit()
 
-#types
-for _, row in df.iterrows():
-    show_id = row["show_id"]
-    genres = row["genres"]
-    if not genres or pd.isna(genres):
-        continue
-    for g in genres.split(","):
-        genre_name = g.strip()
-        if genre_name == "":
-            continue
-        cur.execute("SELECT genre_id FROM genres WHERE name = ?", (genre_name,))
-        genre_id = cur.fetchone()[0]
-        cur.execute("INSERT OR IGNORE INTO types (show_id, genre_id) VALUES (?, ?)", (show_id, genre_id))
-conn.commit()
-
-#companies
-all_companies = (
-    df["production_companies"].str.split(",").explode().str.strip().unique()
-)
-
-for c in all_companies:
-    cur.execute("INSERT OR IGNORE INTO companies (name) VALUES (?)", (c,))
-conn.commit()
-
-#production
-for _, row in df.iterrows():
-    show_id = row["show_id"]
-    companies = row["production_companies"]
-    if not companies or pd.isna(companies):
-        continue
-    for c in companies.split(","):
-        company_name = c.strip()
-        if company_name == "":
-            continue
-        cur.execute("SELECT producer_id FROM companies WHERE name = ?", (company_name,))
-        producer_id = cur.fetchone()[0]
-        cur.execute("INSERT OR IGNORE INTO production (show_id, producer_id) VALUES (?, ?)", (show_id, producer_id))
-conn.commit()
-
-#people, top_cast, writers, creators e directors
-def explode_names(cell):
-    if cell is None:
-        return []
-    if isinstance(cell, float) and math.isnan(cell):
-        return []
-    s = str(cell).strip()
-    if s == "":
-        return []
-    return [p.strip() for p in s.split(",") if p.strip() != ""]
-
-
-def get_or_create_person(cur, name):
-    cur.execute("SELECT person_id FROM people WHERE name = ?", (name,))
-    rows = cur.fetchall()
-
-    if len(rows) > 0:
-        main_id = rows[0][0]
-        for extra in rows[1:]:
-            cur.execute("DELETE FROM people WHERE person_id = ?", (extra[0],))
-
-        return main_id
-
-    cur.execute("INSERT INTO people (name) VALUES (?)", (name,))
-    return cur.lastrowid
-
-
-def populate_relationship(df, cur, conn, colname, link_table):
-    for _, row in df.iterrows():
-        show_id = row.get("show_id")
-        if show_id is None or (isinstance(show_id, float) and math.isnan(show_id)):
-            continue
+    #os índices UNIQUE dos nomes são preenchidos por ordem de chegada e ficam com
+    #páginas meio vazias; o VACUUM reescreve-os compactos (antes das tabelas da
+    #FAQ, que dependem da ordem dos rowids)
+    cur.execute("VACUUM")
 
-        names = explode_names(row.get(colname))
+    #respostas da FAQ, shows semelhantes e colaborações pré-calculados
+    faq.materialize(cur)
+    similar.materialize(cur)
+    collaborations.materialize(cur)
+    conn.commit()
 
-        for name in names:
-            pid = get_or_create_person(cur, name)
-            cur.execute(
-                f"INSERT OR IGNORE INTO {link_table} (show_id, person_id) VALUES (?, ?)",
-                (show_id, pid)
-            )
+    problems = check_query_plans(cur, route_queries())
+    if problems:
+        for sql, detail in problems:
+            print("full scan: {}\n    in: {}".format(detail, sql), file=sys.stderr)
+        conn.close()
+        sys.exit(1)
 
+    stamp_build()
     conn.commit()
 
-populate_relationship(df, cur, conn, "director",    "directors")
-populate_relationship(df, cur, conn, "writer",      "writers")
-populate_relationship(df, cur, conn, "top_cast",    "top_cast")
-populate_relationship(df, cur, conn, "created_by",  "creators")
-
-conn.commit()
-conn.close()
\ No newline at end of file
+    #a cópia é uma única transação na BD em uso: os leitores passam da versão
+    #antiga para a nova de uma vez
+    live = sqlite3.connect(DB_FILE)
+    conn.backup(live)
+    # WAL deixa o site ler (ligações mode=ro do db.py) enquanto se escreve
+    live.execute("PRAGMA journal_mode=WAL")
+    live.close()
+
+#sincronização incremental: compara o hash de cada linha do CSV com o guardado
+#e só reescreve os shows que mudaram, tudo na mesma transação
+def sync():
+    for table in ["show_hashes", "metadata", "person_roles", "similar_shows", "collaborations"]:
+        if cur.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone() is None:
+            sys.exit("{} has no {} table, run a full build first".format(DB_FILE, table))
+
+    for _, table, id_col in LINKS:
+        IDS[table] = {name_key(name): i for name, i in cur.execute(f"SELECT name, {id_col} FROM {table}")}
+    stored = dict(cur.execute("SELECT show_id, hash FROM show_hashes"))
+
+    seen = set()
+    orphans = {"genres": set(), "companies": set(), "people": set()}
+    loaded = []
+    for chunk, hashes in read_chunks(args.csv):
+        ids = chunk["id"].tolist()
+        seen.update(ids)
+        mask = [stored.get(i) != h for i, h in zip(ids, hashes.tolist())]
+        if not any(mask):
+            continue
+        chunk, hashes = chunk[mask], hashes[mask]
+        for table, found in delete_shows(chunk["id"].tolist()).items():
+            orphans[table] |= found
+        load_chunk(chunk, hashes)
+        loaded += chunk["id"].tolist()
+
+    removed = [i for i in stored if i not in seen]
+    for table, found in delete_shows(removed).items():
+        orphans[table] |= found
+    delete_orphans(orphans)
+
+    if loaded or removed:
+        faq.materialize(cur)
+        similar.update(cur, loaded + removed)
+        #pessoas que perderam ou ganharam ligações a shows
+        people = orphans["people"] | {r[0] for i in loaded for r in cur.execute(
+            "SELECT person_id FROM person_roles WHERE show_id = ?", (i,))}
+        collaborations.update(cur, people)
+        stamp_build()
+
+    cur.execute("PRAGMA optimize")
+    conn.commit()
+    print("{} shows added or updated, {} removed".format(len(loaded), len(removed)))
+
+if args.incremental:
+    #a BD em uso é alterada numa só transação (em WAL os leitores veem a versão
+    #anterior até ao commit)
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    sync()
+    conn.close()
+else:
+    if os.path.exists(BUILD_FILE):
+        os.remove(BUILD_FILE)
+    conn = sqlite3.connect(BUILD_FILE)
+    cur = conn.cursor()
+    build()
+    conn.close()
+    os.remove(BUILD_FILE)
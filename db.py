@@ -1,29 +1,226 @@
+import hashlib
 import logging
+import os
+import random
 import sqlite3
-import re
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_app_context
 
 global DB, DB_FILE
 
 DB_FILE = 'Metacritic.db'
 
+# Número máximo de ligações abertas em simultâneo (uma por pedido)
+POOL_SIZE = 16
+POOL_TIMEOUT = 30
+
+# Cache de resultados: nº máximo de queries guardadas (LRU), validade em
+# segundos (None = até a BD mudar) e intervalo entre verificações do ficheiro
+CACHE_SIZE = 1024
+CACHE_TTL = None
+CACHE_CHECK_INTERVAL = 1.0
+
+# Fração das queries escritas no log (0 desliga); só para depuração
+SQL_LOG_SAMPLE = float(os.environ.get('SQL_LOG_SAMPLE', 0))
+
 DB = dict()
 
-def connect():
+_LOCAL = threading.local()
+
+CACHE = OrderedDict()
+CACHE_STATS = {'hits': 0, 'misses': 0}
+_CACHE_LOCK = threading.Lock()
+
+# Queries das rotas, registadas por nome e normalizadas uma única vez
+STATEMENTS = dict()
+
+# Cópia do catálogo em memória (snapshot.py), opcional; só é usada enquanto
+# corresponder à build atual da BD
+SNAPSHOT = None
+
+def _open():
+  # cada ligação guarda as queries já compiladas (uma por texto SQL)
+  c = sqlite3.connect('file:{}?mode=ro'.format(DB_FILE), uri=True,
+                      check_same_thread=False, cached_statements=256)
+  c.row_factory = sqlite3.Row
+  return c
+
+def connect(pool_size=POOL_SIZE):
   global DB, DB_FILE
-  c = sqlite3.connect(DB_FILE, check_same_thread=False)
+  DB['idle'] = []
+  DB['slots'] = threading.BoundedSemaphore(pool_size)
+  DB['lock'] = threading.Lock()
+  # valida já o ficheiro em vez de falhar no primeiro pedido
+  c = _open()
+  if c.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+    logging.warning('{} is not in WAL mode, readers may block during writes'
+                    .format(DB_FILE))
+  DB['idle'].append(c)
   print("connected", c)
-  c.row_factory = sqlite3.Row
-  DB['conn'] = c
-  DB['cursor'] = c.cursor()
-  logging.info('Connected to database')
+  logging.info('Connected to database (pool of {})'.format(pool_size))
 
-def execute(sql,args=None):
-  global DB
-  sql = re.sub('\s+',' ', sql)
-  logging.info('SQL: {} Args: {}'.format(sql,args))
-  return DB['cursor'].execute(sql, args) \
-      if args != None else DB['cursor'].execute(sql)
+def _checkout():
+  if 'slots' not in DB:
+    connect()
+  if not DB['slots'].acquire(timeout=POOL_TIMEOUT):
+    raise sqlite3.OperationalError('no database connection available')
+  with DB['lock']:
+    if DB['idle']:
+      return DB['idle'].pop()
+  try:
+    return _open()
+  except Exception:
+    DB['slots'].release()
+    raise
+
+def _checkin(c):
+  with DB['lock']:
+    DB['idle'].append(c)
+  DB['slots'].release()
+
+def connection():
+  # dentro de um pedido Flask a ligação fica em g até ao teardown;
+  # fora dele (scripts) cada thread fica com a sua
+  if has_app_context():
+    if 'db_conn' not in g:
+      g.db_conn = _checkout()
+    return g.db_conn
+  c = getattr(_LOCAL, 'conn', None)
+  if c is None:
+    c = _LOCAL.conn = _checkout()
+  return c
+
+def release(exc=None):
+  c = g.pop('db_conn', None)
+  if c is not None:
+    _checkin(c)
+
+def init_app(app):
+  app.teardown_appcontext(release)
+
+def _run(sql, args):
+  if SQL_LOG_SAMPLE and random.random() < SQL_LOG_SAMPLE:
+    logging.info('SQL: %s Args: %s', sql, args)
+  c = connection()
+  return c.execute(sql, args) if args != None else c.execute(sql)
+
+# Resultado guardado em cache, com a mesma interface que o cursor usado nas rotas
+class Result:
+  __slots__ = ('rows',)
+
+  def __init__(self, rows):
+    self.rows = rows
+
+  def fetchall(self):
+    return list(self.rows)
+
+  def fetchone(self):
+    return self.rows[0] if self.rows else None
+
+  def __iter__(self):
+    return iter(self.rows)
+
+# A BD só muda quando o create_bd.py corre, e em WAL qualquer commit altera
+# o ficheiro -wal: basta comparar mtime/tamanho dos dois ficheiros
+def _file_version():
+  version = []
+  for f in (DB_FILE, DB_FILE + '-wal'):
+    try:
+      st = os.stat(f)
+      version.append((st.st_mtime_ns, st.st_size))
+    except OSError:
+      version.append(None)
+  return tuple(version)
+
+def db_version():
+  now = time.monotonic()
+  if now - DB.get('checked', 0) >= CACHE_CHECK_INTERVAL:
+    DB['checked'] = now
+    version = _file_version()
+    if version != DB.get('version'):
+      DB['version'] = version
+      with _CACHE_LOCK:
+        CACHE.clear()
+  return DB['version']
+
+# Identificador da build escrito pelo create_bd.py na tabela metadata; só é
+# relido quando o ficheiro muda. BDs antigas, sem a tabela, usam a versão do ficheiro
+# (sem ficheiro, built_at fica 0 e o erro da BD aparece na própria rota)
+def build_info():
+  version = db_version()
+  cached = DB.get('build')
+  if cached is not None and cached[0] == version:
+    return cached[1]
+  try:
+    info = dict(_run("SELECT key, value FROM metadata WHERE key IN ('build', 'built_at')",
+                     None).fetchall())
+  except sqlite3.OperationalError:
+    info = {}
+  if 'build' not in info:
+    info['build'] = hashlib.sha1(repr(version).encode()).hexdigest()
+    info['built_at'] = max((v[0] for v in version if v is not None), default=0) // 10**9
+  info['built_at'] = int(info['built_at'])
+  DB['build'] = (version, info)
+  return info
+
+def cache_info():
+  with _CACHE_LOCK:
+    return dict(CACHE_STATS, size=len(CACHE), max_size=CACHE_SIZE)
+
+def execute(sql,args=None,cache=True):
+  if not cache or CACHE_SIZE == 0:
+    return _run(sql, args)
+
+  key = (sql, tuple(args) if args != None else None)
+  version = db_version()
+  with _CACHE_LOCK:
+    entry = CACHE.get(key)
+    if entry is not None and entry[0] == version \
+        and (entry[1] is None or entry[1] > time.monotonic()):
+      CACHE.move_to_end(key)
+      CACHE_STATS['hits'] += 1
+      return Result(entry[2])
+    CACHE_STATS['misses'] += 1
+
+  rows = _run(sql, args).fetchall()
+  expires = time.monotonic() + CACHE_TTL if CACHE_TTL is not None else None
+  with _CACHE_LOCK:
+    CACHE[key] = (version, expires, rows)
+    CACHE.move_to_end(key)
+    while len(CACHE) > CACHE_SIZE:
+      CACHE.popitem(last=False)
+  return Result(rows)
+
+def prepare(name, sql):
+  STATEMENTS[name] = ' '.join(sql.split())
+
+def query(name, args=None, cache=True):
+  snap = SNAPSHOT
+  if snap is not None and name in snap.QUERIES and snap.build == build_info()['build']:
+    return Result(snap.query(name, args or ()))
+  return execute(STATEMENTS[name], args, cache)
+
+# Para respostas em stream: o teardown do pedido corre antes de a resposta ser
+# enviada, por isso o cursor usa uma ligação própria, devolvida ao pool pela
+# função que acompanha o cursor (quando a resposta fecha)
+def query_stream(name, args=None):
+  c = _checkout()
+  try:
+    rows = c.execute(STATEMENTS[name], args if args != None else [])
+  except Exception:
+    _checkin(c)
+    raise
+  return rows, lambda: _checkin(c)
 
 def close():
   global DB
-  DB['conn'].close()
+  c = getattr(_LOCAL, 'conn', None)
+  if c is not None:
+    _LOCAL.conn = None
+    _checkin(c)
+  with DB['lock']:
+    for c in DB['idle']:
+      c.close()
+    DB['idle'] = []
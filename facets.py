@@ -0,0 +1,151 @@
+import threading
+from bisect import bisect_left, bisect_right
+import numpy as np
+import db
+
+# Filtros (facetas) da lista de shows com índices de bitmaps. Cada valor de uma
+# faceta é um int do Python em que o bit i é o i-ésimo show (por show_id):
+# juntar filtros é AND/OR de inteiros e cada contagem é um popcount. O índice é
+# construído por processo no primeiro pedido e de novo quando a build muda.
+
+# faceta -> (coluna de facets_shows, ou None para os géneros; largura das classes
+# nas facetas de intervalo, None nas de valores)
+FACETS = {
+  'genre': (None, None),
+  'rating': (1, None),
+  'year': (2, 10),
+  'seasons': (3, 5),
+  'metascore': (4, 10),
+  'userscore': (5, 10),
+}
+
+db.prepare('facets_shows', '''
+  SELECT s.show_id, s.rating, CAST(substr(s.releaseDate, 1, 4) AS INTEGER) AS year,
+         s.num_seasons, m.metascore, u.userscore
+  FROM shows s
+  LEFT JOIN metascore m ON m.show_id = s.show_id
+  LEFT JOIN userscore u ON u.show_id = s.show_id
+  ORDER BY s.show_id
+''')
+
+db.prepare('facets_genres', 'SELECT show_id, name FROM types NATURAL JOIN genres')
+
+def bitmap(mask):
+  return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+def unpack(bits, n):
+  raw = np.frombuffer(bits.to_bytes((n + 7) // 8, 'little'), dtype=np.uint8)
+  return np.unpackbits(raw, count=n, bitorder='little').view(bool)
+
+# um bitmap por valor; vários valores escolhidos juntam-se com OR
+class Values:
+  def __init__(self, positions, values, n):
+    self.bits = {}
+    keys, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    for j, value in enumerate(keys.tolist()):
+      mask = np.zeros(n, dtype=bool)
+      mask[positions[inverse == j]] = True
+      self.bits[value] = bitmap(mask)
+
+  def match(self, chosen):
+    bits = 0
+    for value in chosen:
+      bits |= self.bits.get(value, 0)
+    return bits
+
+  def counts(self, base):
+    return [(value, (base & bits).bit_count()) for value, bits in self.bits.items()]
+
+# bitmaps cumulativos (le[j]: shows com valor <= values[j]): qualquer intervalo
+# custa um AND NOT, e cada classe de 'width' valores é um intervalo
+class Range:
+  def __init__(self, positions, values, n, width):
+    values = np.asarray(values, dtype=np.int64)
+    self.values = np.unique(values).tolist()
+    order = np.argsort(values, kind='stable')
+    ends = np.searchsorted(values[order], self.values, side='right')
+    mask = np.zeros(n, dtype=bool)
+    self.le, done = [], 0
+    for end in ends:
+      mask[positions[order[done:end]]] = True
+      self.le.append(bitmap(mask))
+      done = end
+    lows = sorted({v // width * width for v in self.values})
+    self.buckets = [(low, min(low + width - 1, self.values[-1])) for low in lows]
+
+  def match(self, chosen):
+    low, high = chosen
+    hi = bisect_right(self.values, high) - 1 if high is not None else len(self.values) - 1
+    lo = bisect_left(self.values, low) - 1 if low is not None else -1
+    if hi < 0:
+      return 0
+    return self.le[hi] & ~self.le[lo] if lo >= 0 else self.le[hi]
+
+  def counts(self, base):
+    return [(low, high, (base & self.match((low, high))).bit_count()) for low, high in self.buckets]
+
+class Index:
+  def __init__(self, build, orders):
+    self.build = build
+    rows = db.query('facets_shows', cache=False).fetchall()
+    self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+    n = len(self.ids)
+    self.all = (1 << n) - 1
+
+    self.facets = {}
+    for name, (column, width) in FACETS.items():
+      if column is None:
+        pairs = db.query('facets_genres', cache=False).fetchall()
+      else:
+        pairs = [(r[0], r[column]) for r in rows if r[column] is not None]
+      positions = np.searchsorted(self.ids, [p[0] for p in pairs]).astype(np.int64)
+      values = [p[1] for p in pairs]
+      if width is None:
+        self.facets[name] = Values(positions, values, n)
+      else:
+        self.facets[name] = Range(positions, values, n, width)
+
+    #posições dos shows por cada ordenação da lista (a mesma do SQL)
+    self.orders = {sort: np.searchsorted(self.ids, [r[0] for r in db.query(name, cache=False)])
+                   for sort, name in orders.items()}
+
+  def bitmap(self, ids):
+    mask = np.zeros(len(self.ids), dtype=bool)
+    mask[np.searchsorted(self.ids, ids)] = True
+    return bitmap(mask)
+
+  # shows que passam em todos os filtros e, para cada faceta, as contagens dos
+  # seus valores com os filtros das outras (escolher um valor não esconde os outros)
+  def select(self, chosen, base=None):
+    base = self.all if base is None else base
+    matches = {name: self.facets[name].match(value) for name, value in chosen.items()}
+    bits = base
+    for match in matches.values():
+      bits &= match
+    counts = {}
+    for name, facet in self.facets.items():
+      others = base
+      for other, match in matches.items():
+        if other != name:
+          others &= match
+      counts[name] = facet.counts(others)
+    return bits, counts
+
+  # ids dos shows do bitmap pela ordenação pedida
+  def ordered(self, bits, sort):
+    order = self.orders[sort]
+    return self.ids[order[unpack(bits, len(self.ids))[order]]]
+
+INDEX = {'index': None}
+_LOCK = threading.Lock()
+
+# índice da build atual; 'orders' liga cada ordenação à query com os show_id por essa ordem
+def current(orders):
+  build = db.build_info()['build']
+  index = INDEX['index']
+  if index is None or index.build != build:
+    with _LOCK:
+      index = INDEX['index']
+      if index is None or index.build != build:
+        index = INDEX['index'] = Index(build, orders)
+  return index
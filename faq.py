@@ -0,0 +1,386 @@
+# Perguntas da FAQ. As respostas são calculadas pelo create_bd.py e guardadas
+# nas tabelas faq_p1 ... faq_p13, que o site lê diretamente.
+import hashlib
+
+QUESTIONS = [
+    ("p1", "Highest metascore by genre"),
+    ("p2", "Highest userscore by genre"),
+    ("p3", "Percentage histogram of movies by metascore range"),
+    ("p4", "Top 20 largest absolute difference meta vs user"),
+    ("p5", "Show with highest metascore each year"),
+    ("p6", "Shows with metascore higher than the average of their genre"),
+    ("p7", "Shows with the same main cast in different years"),
+    ("p8", "Shows where a person had different roles"),
+    ("p9", "Top 100 shows with most people in production"),
+    ("p10","Bottom 100 shows with least people in production"),
+    ("p11","Top 5 Genres with Most Movies"),
+    ("p12","Genre with Highest Metascore by Decade"),
+    ("p13","Genre with Highest Userscore by Decade"),
+]
+
+QUERIES = {}
+
+# --------------------------
+# p1 — Maior metascore por género
+# --------------------------
+QUERIES["p1"] = """
+    WITH Ranked AS (
+        SELECT g.name, s.title, m.metascore,
+            RANK() OVER (
+                PARTITION BY g.genre_id
+                ORDER BY m.metascore DESC, m.metascore_count DESC
+            ) AS pos
+        FROM shows s
+        NATURAL JOIN metascore m
+        NATURAL JOIN types
+        NATURAL JOIN genres g
+        WHERE m.metascore IS NOT NULL AND m.metascore_count IS NOT NULL
+    )
+    SELECT name, title, metascore
+    FROM Ranked
+    WHERE pos = 1
+    ORDER BY name;
+"""
+
+# --------------------------
+# p2 — Maior userscore por género
+# --------------------------
+QUERIES["p2"] = """
+    WITH Ranked AS (
+        SELECT g.name, s.title, u.userscore,
+            RANK() OVER (
+                PARTITION BY g.genre_id
+                ORDER BY u.userscore DESC, u.userscore_count DESC
+            ) AS pos
+        FROM shows s
+        NATURAL JOIN userscore u
+        NATURAL JOIN types
+        NATURAL JOIN genres g
+        WHERE u.userscore IS NOT NULL AND u.userscore_count IS NOT NULL
+    )
+    SELECT name, title, userscore
+    FROM Ranked
+    WHERE pos = 1
+    ORDER BY name;
+"""
+
+# --------------------------
+# p3 — histograma percentual de filmes por faixa de metascore
+# --------------------------
+QUERIES["p3"] = """
+    WITH Total AS (
+        SELECT COUNT(*) AS total_filmes
+        FROM metascore
+    ),
+    Buckets AS (
+        SELECT 
+            (metascore / 20) * 20 AS bucket_start,
+            COUNT(*) AS total_in_bucket
+        FROM metascore
+        GROUP BY bucket_start
+    )
+    SELECT
+        bucket_start || '-' || (bucket_start + 19) AS interval,
+        ROUND((CAST(total_in_bucket AS REAL) / (SELECT total_filmes FROM Total)) * 100, 2) AS percent
+    FROM Buckets
+    ORDER BY bucket_start;
+"""
+
+# --------------------------
+# p4 — Top 20 maior diferença absoluta meta vs user
+# --------------------------
+QUERIES["p4"] = """
+    SELECT s.title, ABS(m.metascore - u.userscore) AS diferenca
+    FROM shows s
+    NATURAL JOIN metascore m
+    NATURAL JOIN userscore u
+    WHERE metascore_count != 0 AND userscore_count != 0
+    ORDER BY diferenca DESC, s.title
+    LIMIT 20;
+"""
+
+# --------------------------
+# p5 — Filme com maior metascore em cada ano
+# --------------------------
+QUERIES["p5"] = """
+    WITH MaxMetascorePerYear AS (
+    SELECT substr(s.releaseDate,1,4) AS year,
+        MAX(m.metascore) AS max_metascore
+    FROM shows s
+    JOIN metascore m ON s.show_id = m.show_id
+    WHERE m.metascore IS NOT NULL
+    GROUP BY year
+    )
+    SELECT s.title, s.releaseDate, substr(s.releaseDate,1,4) AS year, m.metascore
+    FROM MaxMetascorePerYear mm
+    JOIN shows s ON substr(s.releaseDate,1,4) = mm.year
+    JOIN metascore m ON s.show_id = m.show_id
+    WHERE m.metascore = mm.max_metascore
+    AND s.show_id = (
+        SELECT MIN(s2.show_id)
+        FROM shows s2
+        JOIN metascore m2 ON s2.show_id = m2.show_id
+        WHERE substr(s2.releaseDate,1,4) = mm.year
+        AND m2.metascore = mm.max_metascore
+    )
+    ORDER BY year;
+"""
+
+# --------------------------
+# p6 — Filmes com metascore maior que a média do seu género
+# --------------------------
+QUERIES["p6"] = """
+    WITH GenreAvg AS (
+        SELECT t2.genre_id, AVG(m2.metascore) AS avg_metascore
+        FROM shows s2
+        JOIN metascore m2 ON s2.show_id = m2.show_id
+        JOIN types t2 ON s2.show_id = t2.show_id
+        GROUP BY t2.genre_id
+    )
+    SELECT 
+        s.title AS title,
+        g.name AS genre,
+        m.metascore AS metascore
+    FROM shows s
+    JOIN metascore m ON s.show_id = m.show_id
+    JOIN types t ON s.show_id = t.show_id
+    JOIN genres g ON t.genre_id = g.genre_id
+    JOIN GenreAvg ga ON ga.genre_id = g.genre_id
+    WHERE m.metascore IS NOT NULL
+    AND m.metascore > ga.avg_metascore
+    ORDER BY g.name, m.metascore DESC;
+"""
+
+# --------------------------
+# p7 — Shows com o mesmo elenco principal em anos diferentes
+# O elenco principal são os primeiros `size` ids de top_cast por ordem; a tabela
+# cast_signatures guarda um hash desses ids por show e por tamanho, e os elencos
+# iguais saem de um GROUP BY sobre a chave primária
+# --------------------------
+QUERIES["p7"] = """
+    WITH Repeated AS (
+        SELECT signature
+        FROM cast_signatures
+        WHERE size = ?
+        GROUP BY signature
+        HAVING COUNT(*) > 1
+    )
+    SELECT
+        s1.title AS show_1_title,
+        s2.title AS show_2_title,
+        s1.releaseDate AS show_1_year,
+        s2.releaseDate AS show_2_year
+    FROM Repeated r
+    JOIN cast_signatures c1 ON c1.size = ? AND c1.signature = r.signature
+    JOIN cast_signatures c2 ON c2.size = ? AND c2.signature = r.signature
+     AND c1.show_id < c2.show_id
+    JOIN shows s1 ON s1.show_id = c1.show_id
+    JOIN shows s2 ON s2.show_id = c2.show_id
+    WHERE ABS(CAST(substr(s1.releaseDate, 1, 4) AS INTEGER) -
+              CAST(substr(s2.releaseDate, 1, 4) AS INTEGER)) >= ?
+    ORDER BY s1.title, s2.title;
+"""
+
+# --------------------------
+# Uma linha por (show, pessoa, papel): as perguntas sobre papéis agrupam esta
+# relação em vez de juntar as tabelas de papéis umas com as outras (o que
+# multiplica as linhas de cada show antes do DISTINCT)
+# --------------------------
+ROLES = """
+    SELECT show_id, person_id, 'director' AS role FROM directors
+    UNION ALL
+    SELECT show_id, person_id, 'writer' FROM writers
+    UNION ALL
+    SELECT show_id, person_id, 'creator' FROM creators
+    UNION ALL
+    SELECT show_id, person_id, 'actor' FROM top_cast
+"""
+
+# --------------------------
+# p8 — Shows onde uma pessoa teve papéis diferentes
+# --------------------------
+QUERIES["p8"] = """
+    SELECT DISTINCT s.title, p.name
+    FROM (
+        SELECT show_id, person_id
+        FROM ({roles})
+        GROUP BY show_id, person_id
+        HAVING COUNT(*) >= 2
+    ) r
+    JOIN shows s ON s.show_id = r.show_id
+    JOIN people p ON p.person_id = r.person_id
+    ORDER BY s.title, p.name;
+""".format(roles=ROLES)
+
+# --------------------------
+# p9 — Top 100 shows com mais pessoas na produção (director+writer+creator)
+# --------------------------
+QUERIES["p9"] = """
+    SELECT s.title, r.total_people
+    FROM (
+        SELECT show_id, COUNT(*) AS total_people
+        FROM ({roles})
+        WHERE role <> 'actor'
+        GROUP BY show_id
+    ) r
+    JOIN shows s ON s.show_id = r.show_id
+    ORDER BY r.total_people DESC, s.title
+    LIMIT 100;
+""".format(roles=ROLES)
+
+# --------------------------
+# p10 — Bottom 100 shows com menos pessoas na produção (director+writer+creator)
+# --------------------------
+QUERIES["p10"] = """
+    SELECT s.title, r.total_people
+    FROM (
+        SELECT show_id, COUNT(*) AS total_people
+        FROM ({roles})
+        WHERE role <> 'actor'
+        GROUP BY show_id
+    ) r
+    JOIN shows s ON s.show_id = r.show_id
+    ORDER BY r.total_people, s.title
+    LIMIT 100;
+""".format(roles=ROLES)
+
+# --------------------------
+# p11 — Top 5 Gêneros com Mais Filmes
+# --------------------------
+QUERIES["p11"] = """
+    SELECT 
+        g.name AS genre,
+        COUNT(t.show_id) AS total_movies
+    FROM genres g
+    JOIN types t ON g.genre_id = t.genre_id
+    GROUP BY g.genre_id
+    ORDER BY total_movies DESC
+    LIMIT 5;
+"""
+
+# --------------------------
+# p12 — Gênero com Maior Metascore por Década
+# --------------------------
+QUERIES["p12"] = """
+    WITH MetaPerDecade AS (
+        SELECT 
+            (CAST(substr(s.releaseDate,1,4) AS INTEGER) / 10) * 10 AS decade,
+            g.genre_id,
+            g.name AS genre,
+            MAX(m.metascore) AS max_metascore,
+            COUNT(*) AS film_count
+        FROM shows s
+        JOIN types t ON s.show_id = t.show_id
+        JOIN genres g ON t.genre_id = g.genre_id
+        JOIN metascore m ON s.show_id = m.show_id
+        WHERE releaseDate IS NOT NULL
+        AND length(releaseDate) >= 4
+        AND substr(releaseDate,1,4) GLOB '[0-9][0-9][0-9][0-9]'
+        GROUP BY decade, g.genre_id
+    ),
+    Ranked AS (
+        SELECT 
+            decade,
+            genre,
+            max_metascore,
+            film_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY decade
+                ORDER BY max_metascore DESC, film_count DESC, genre_id ASC
+            ) AS rn
+        FROM MetaPerDecade
+    )
+    SELECT decade, genre, max_metascore
+    FROM Ranked
+    WHERE rn = 1
+    ORDER BY decade;
+"""
+
+# --------------------------
+# p13 — Gênero com Maior Userscore por Década
+# --------------------------
+QUERIES["p13"] = """
+    WITH UserPerDecade AS (
+        SELECT 
+            (CAST(substr(s.releaseDate,1,4) AS INTEGER) / 10) * 10 AS decade,
+            g.genre_id,
+            g.name AS genre,
+            MAX(u.userscore) AS max_userscore,
+            COUNT(*) AS film_count
+        FROM shows s
+        JOIN types t ON s.show_id = t.show_id
+        JOIN genres g ON t.genre_id = g.genre_id
+        JOIN userscore u ON s.show_id = u.show_id
+        WHERE releaseDate IS NOT NULL
+          AND length(releaseDate) >= 4
+          AND substr(releaseDate,1,4) GLOB '[0-9][0-9][0-9][0-9]'
+        GROUP BY decade, g.genre_id
+    ),
+    Ranked AS (
+        SELECT 
+            decade,
+            genre,
+            max_userscore,
+            film_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY decade
+                ORDER BY max_userscore DESC, film_count DESC, genre_id ASC
+            ) AS rn
+        FROM UserPerDecade
+    )
+    SELECT decade, genre, max_userscore
+    FROM Ranked
+    WHERE rn = 1
+    ORDER BY decade;
+"""
+
+# --------------------------
+# Perguntas com parâmetros: valores usados nas tabelas faq_pN, limites aceites
+# nos pedidos (/faq/p7/?size=3&gap=10) e ordem dos ? na query
+# --------------------------
+MAX_CAST = 10
+
+PARAMS = {
+    "p7": {"size": (5, 1, MAX_CAST), "gap": (1, 0, 100)},
+}
+
+BINDINGS = {
+    "p7": ["size", "size", "size", "gap"],
+}
+
+def arguments(name, values=None):
+    values = dict({k: p[0] for k, p in PARAMS.get(name, {}).items()}, **(values or {}))
+    return [values[k] for k in BINDINGS.get(name, [])]
+
+# Assinatura de um elenco: hash estável (não muda entre execuções, ao contrário
+# de hash()) da lista ordenada de ids
+def signature(ids):
+    digest = hashlib.blake2b(",".join(map(str, ids)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+CAST_SIGNATURES = """
+    CREATE TABLE cast_signatures(
+        size             INTEGER NOT NULL,
+        signature        INTEGER NOT NULL,
+        show_id          INTEGER NOT NULL,
+        PRIMARY KEY (size, signature, show_id),
+        FOREIGN KEY (show_id) REFERENCES shows(show_id)
+    ) WITHOUT ROWID
+"""
+
+def cast_signatures(cur):
+    casts = {}
+    rows = cur.execute("SELECT show_id, person_id FROM top_cast ORDER BY show_id, person_id").fetchall()
+    for show_id, person_id in rows:
+        casts.setdefault(show_id, []).append(person_id)
+    cur.execute("DROP TABLE IF EXISTS cast_signatures")
+    cur.execute(CAST_SIGNATURES)
+    cur.executemany("INSERT INTO cast_signatures (size, signature, show_id) VALUES (?, ?, ?)",
+                    ((size, signature(ids[:size]), show_id) for show_id, ids in casts.items()
+                     for size in range(1, min(len(ids), MAX_CAST) + 1)))
+
+def materialize(cur):
+    cast_signatures(cur)
+    for name, sql in QUERIES.items():
+        cur.execute("DROP TABLE IF EXISTS faq_{}".format(name))
+        cur.execute("CREATE TABLE faq_{} AS {}".format(name, sql.strip().rstrip(";")), arguments(name))
@@ -1,12 +1,202 @@
 #! /usr/bin/python3
+import argparse
+import gc
 import logging
-from app import APP
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 import db
+import snapshot
+
+parser = argparse.ArgumentParser(description='Serve o site (vários processos com N threads cada)')
+parser.add_argument('--host', default='0.0.0.0')
+parser.add_argument('--port', type=int, default=9000)
+parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                    help='processos a servir pedidos (um por core)')
+parser.add_argument('--threads', type=int, default=8,
+                    help='pedidos em simultâneo por processo (e ligações à BD)')
+parser.add_argument('--heavy', type=int, default=2,
+                    help='pedidos pesados (FAQ com parâmetros, coleções da API) em simultâneo por processo')
+parser.add_argument('--reload-interval', type=float, default=5,
+                    help='segundos entre verificações de uma nova build da BD')
+parser.add_argument('--snapshot', action='store_true',
+                    help='serve detalhes e listas de uma cópia da BD em memória, '
+                         'carregada uma vez e partilhada pelos processos')
+
+# a ligação fecha depois de cada resposta e um cliente parado desiste ao fim
+# de 'timeout' segundos: nenhum prende uma thread (nem o fim do processo)
+class Handler(WSGIRequestHandler):
+  protocol_version = 'HTTP/1.0'
+  timeout = 60
+
+# servidor com um número fixo de threads em vez de uma thread por pedido
+class PoolServer(BaseWSGIServer):
+  multithread = True
+
+  # espera máxima por uma thread livre antes de voltar ao ciclo do serve_forever
+  # (que assim continua a ver o pedido de shutdown)
+  SLOT_WAIT = 0.5
+
+  def __init__(self, host, port, app, threads, fd):
+    super().__init__(host, port, app, handler=Handler, fd=fd)
+    # o socket é partilhado por todos os processos: quem perde a corrida pela
+    # ligação não pode ficar bloqueado no accept (nem impedir o shutdown)
+    self.socket.setblocking(False)
+    self.pool = ThreadPoolExecutor(threads)
+    self.slots = threading.BoundedSemaphore(threads)
+
+  # só aceita uma ligação quando há uma thread livre para ela: um processo
+  # ocupado deixa-a no socket para outro, em vez de a pôr numa fila sua
+  def get_request(self):
+    if not self.slots.acquire(timeout=self.SLOT_WAIT):
+      raise BlockingIOError
+    try:
+      return super().get_request()
+    except BaseException:
+      self.slots.release()
+      raise
+
+  def process_request(self, request, client_address):
+    self.pool.submit(self.process_request_thread, request, client_address)
+
+  def process_request_thread(self, request, client_address):
+    try:
+      self.finish_request(request, client_address)
+    except Exception:
+      self.handle_error(request, client_address)
+    finally:
+      self.shutdown_request(request)
+
+  # chamado uma vez por ligação aceite, em todos os caminhos (também nos de erro)
+  def shutdown_request(self, request):
+    try:
+      super().shutdown_request(request)
+    finally:
+      self.slots.release()
+
+# Processo filho: importa a app e abre as ligações só depois do fork.
+# SIGTERM (esperado com sigwait, sem handler) acaba os pedidos em curso antes de sair
+def worker(sock, args, snap):
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGHUP, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+  from app import create_app
+  app = create_app(args.threads, args.heavy, snap)
+  server = PoolServer(args.host, args.port, app, args.threads, sock.fileno())
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  signal.sigwait({signal.SIGTERM})
+  server.shutdown()
+  server.pool.shutdown(wait=True)
+  db.close()
+  os._exit(0)
+
+# o filho nasce com o SIGTERM bloqueado: um SIGTERM que chegue antes de worker()
+# repor o tratamento fica pendente para o sigwait, em vez de ir ao handler do pai
+def spawn(sock, args, snap=None):
+  signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+  try:
+    pid = os.fork()
+    if pid == 0:
+      try:
+        worker(sock, args, snap)
+      finally:
+        os._exit(1)
+  finally:
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+  return pid
+
+# lida numa ligação própria, fechada logo a seguir: o processo pai nunca
+# fica com ligações abertas que os filhos herdariam
+def build_token():
+  try:
+    c = sqlite3.connect('file:{}?mode=ro'.format(db.DB_FILE), uri=True)
+    try:
+      return c.execute("SELECT value FROM metadata WHERE key = 'build'").fetchone()
+    finally:
+      c.close()
+  except sqlite3.Error:
+    return None
+
+# cópia em memória para uma geração de processos; o gc.freeze() tira-a das
+# recolhas de lixo, que nos filhos escreveriam nas páginas partilhadas. Antes
+# de carregar a seguinte, o unfreeze() devolve a anterior ao GC
+def load_snapshot(args):
+  if not args.snapshot:
+    return None
+  gc.unfreeze()
+  gc.collect()
+  snap = snapshot.load(db.DB_FILE)
+  gc.freeze()
+  logging.info('Loaded snapshot of build %s', snap.build)
+  return snap
+
+# Processo pai: mantém os filhos vivos e, quando o create_bd.py acaba uma build
+# (ou com SIGHUP), arranca uma geração nova e só depois termina a anterior
+def main(args):
+  sock = socket.create_server((args.host, args.port), backlog=1024)
+  sock.set_inheritable(True)
+  logging.info('Listening on %s:%d (%d workers x %d threads)',
+               args.host, args.port, args.workers, args.threads)
+
+  state = {'stop': False, 'reload': False}
+  signal.signal(signal.SIGTERM, lambda *_: state.update(stop=True))
+  signal.signal(signal.SIGINT, lambda *_: state.update(stop=True))
+  signal.signal(signal.SIGHUP, lambda *_: state.update(reload=True))
+
+  snap = load_snapshot(args)
+  workers = {spawn(sock, args, snap) for _ in range(args.workers)}
+  token, checked = build_token(), time.monotonic()
+  while not state['stop']:
+    time.sleep(0.2)
+    if time.monotonic() - checked >= args.reload_interval:
+      checked = time.monotonic()
+      new_token = build_token()
+      if new_token != token:
+        token = new_token
+        state['reload'] = True
+
+    if state['reload'] and not state['stop']:
+      state['reload'] = False
+      logging.info('Reloading workers')
+      #a cópia anterior (já só usada pelos filhos antigos) sai antes de ler a nova
+      snap = None
+      snap = load_snapshot(args)
+      old, workers = workers, {spawn(sock, args, snap) for _ in range(args.workers)}
+      for pid in old:
+        os.kill(pid, signal.SIGTERM)
+
+    while True:
+      try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+      except ChildProcessError:
+        break
+      if pid == 0:
+        break
+      # só se repõem filhos da geração atual, e nunca durante o shutdown
+      if pid in workers:
+        workers.remove(pid)
+        if state['stop']:
+          continue
+        logging.warning('Worker %d exited (status %d), restarting', pid, status)
+        workers.add(spawn(sock, args, snap))
+
+  for pid in workers:
+    os.kill(pid, signal.SIGTERM)
+  for pid in workers:
+    os.waitpid(pid, 0)
+  sock.close()
 
 if __name__ == '__main__':
   logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
-  db.connect()
-  APP.run(host='0.0.0.0', port=9000)
-
+  args = parser.parse_args()
+  if not 0 < args.heavy < args.threads:
+    parser.error('--heavy must be between 1 and --threads - 1')
+  main(args)
@@ -0,0 +1,140 @@
+# Shows semelhantes. Cada show é um vetor esparso com os seus géneros, pessoas
+# (em qualquer papel) e produtoras, com peso IDF; o create_bd.py guarda os K
+# vizinhos de maior cosseno na tabela similar_shows, que o site lê diretamente.
+import numpy as np
+
+K = 10
+
+# Memória por bloco de linhas da matriz de resultados (bloco x todos os shows); a
+# matriz N x N completa nunca existe em memória. Cada célula custa o float64 do
+# bincount, os float32 dos scores e do produto denso e o int64 do argpartition
+BLOCK_BYTES = 32 * 2 ** 20
+CELL_BYTES = 24
+
+# Características presentes em mais do que esta fração dos shows (géneros, as
+# maiores produtoras) entram num produto de matrizes denso, mais rápido para elas
+# do que percorrer todos os pares de shows que as partilham
+DENSE_FRACTION = 1 / 16
+
+FEATURES = """
+    SELECT show_id, 0, genre_id FROM types
+    UNION ALL
+    SELECT DISTINCT show_id, 1, person_id FROM person_roles
+    UNION ALL
+    SELECT show_id, 2, producer_id FROM production
+"""
+
+SCHEMA = """
+    CREATE TABLE similar_shows(
+        show_id          INTEGER NOT NULL,
+        rank             INTEGER NOT NULL,
+        similar_id       INTEGER NOT NULL,
+        score            REAL NOT NULL,
+        PRIMARY KEY (show_id, rank),
+        FOREIGN KEY (show_id) REFERENCES shows(show_id),
+        FOREIGN KEY (similar_id) REFERENCES shows(show_id)
+    );
+"""
+
+# (show, característica, valor) com cada vetor já normalizado: o cosseno de dois
+# shows é a soma dos produtos dos valores que têm em comum
+def vectors(cur):
+    rows = np.array(cur.execute(FEATURES).fetchall(), dtype=np.int64).reshape(-1, 3)
+    shows, show = np.unique(rows[:, 0], return_inverse=True)
+    _, feature = np.unique(rows[:, 1] << 32 | rows[:, 2], return_inverse=True)
+    df = np.bincount(feature)
+    value = np.log(len(shows) / df)[feature]
+    norm = np.sqrt(np.bincount(show, weights=value ** 2, minlength=len(shows)))
+    value /= np.where(norm > 0, norm, 1)[show]
+    return shows, show, feature, value, df
+
+# características densas (ver DENSE_FRACTION), por id de característica
+def dense_features(df, n):
+    return df > max(1, n * DENSE_FRACTION)
+
+# vizinhos das posições 'targets' (por omissão, de todos os shows)
+def neighbours(shows, show, feature, value, df, k=K, targets=None):
+    n = len(shows)
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+    targets = np.arange(n) if targets is None else np.asarray(targets, dtype=np.int64)
+
+    #características só de um show não aproximam ninguém
+    dense = dense_features(df, n)[feature]
+    sparse = ~dense & (df[feature] > 1)
+
+    dense_ids = np.unique(feature[dense])
+    matrix = np.zeros((n, len(dense_ids)), dtype=np.float32)
+    matrix[show[dense], np.searchsorted(dense_ids, feature[dense])] = value[dense]
+
+    #lista invertida: para cada característica, os shows que a têm
+    order = np.lexsort((show[sparse], feature[sparse]))
+    col_feature = feature[sparse][order]
+    col_show = show[sparse][order]
+    col_value = value[sparse][order]
+    col_start = np.searchsorted(col_feature, np.arange(len(df)))
+    col_size = np.bincount(col_feature, minlength=len(df))
+
+    by_show = np.argsort(col_show, kind="stable")
+    row_start = np.searchsorted(col_show[by_show], np.arange(n + 1))
+
+    block = max(1, BLOCK_BYTES // (CELL_BYTES * n))
+    for lo in range(0, len(targets), block):
+        rows = targets[lo:lo + block]
+        #características esparsas de cada show do bloco
+        counts = row_start[rows + 1] - row_start[rows]
+        entries = by_show[np.repeat(row_start[rows] - np.cumsum(counts) + counts, counts)
+                          + np.arange(counts.sum())]
+        local = np.repeat(np.arange(len(rows)), counts)
+        #pares (show do bloco, outro show) que partilham uma característica esparsa
+        sizes = col_size[col_feature[entries]]
+        first = np.repeat(col_start[col_feature[entries]] - np.cumsum(sizes) + sizes, sizes)
+        others = first + np.arange(sizes.sum())
+        pairs = np.repeat(local, sizes) * n + col_show[others]
+        weights = np.repeat(col_value[entries], sizes) * col_value[others]
+        scores = np.bincount(pairs, weights=weights, minlength=len(rows) * n).astype(np.float32)
+        scores = scores.reshape(len(rows), n)
+        scores += matrix[rows] @ matrix.T
+
+        scores[np.arange(len(rows)), rows] = 0
+        top = np.argpartition(scores, n - k, axis=1)[:, n - k:]
+        best = np.take_along_axis(scores, top, axis=1)
+        #melhor primeiro; empates pelo show_id
+        ranked = np.lexsort((shows[top], -best), axis=1)
+        top = np.take_along_axis(top, ranked, axis=1)
+        best = np.take_along_axis(best, ranked, axis=1)
+
+        for r, i in enumerate(rows):
+            for rank, (j, score) in enumerate(zip(top[r], best[r]), 1):
+                if score > 0:
+                    yield int(shows[i]), rank, int(shows[j]), round(float(score), 4)
+
+INSERT = "INSERT INTO similar_shows (show_id, rank, similar_id, score) VALUES (?, ?, ?, ?)"
+
+#só com execute: no modo incremental corre dentro da transação do create_bd.py
+def materialize(cur, k=K):
+    found = neighbours(*vectors(cur), k)
+    cur.execute("DROP TABLE IF EXISTS similar_shows")
+    cur.execute(SCHEMA)
+    cur.executemany(INSERT, found)
+
+#sincronização incremental: só se recalculam os shows alterados, os que partilham
+#com eles uma característica esparsa (pessoas, produtoras, géneros raros) e os que
+#os tinham entre os vizinhos. Os restantes ficam com a lista que tinham, embora o
+#IDF de todos mude um pouco com o catálogo; uma build completa recalcula tudo
+def update(cur, changed, k=K):
+    changed = set(changed)
+    shows, show, feature, value, df = vectors(cur)
+    present = np.flatnonzero(np.isin(shows, list(changed)))
+    shared = np.isin(feature, feature[np.isin(show, present)])
+    shared &= ~dense_features(df, len(shows))[feature] & (df[feature] > 1)
+    affected = set(shows[show[shared]].tolist()) | set(shows[present].tolist())
+    affected |= {a for a, b in cur.execute("SELECT show_id, similar_id FROM similar_shows")
+                 if b in changed}
+
+    found = list(neighbours(shows, show, feature, value, df, k,
+                            np.flatnonzero(np.isin(shows, list(affected)))))
+    cur.executemany("DELETE FROM similar_shows WHERE show_id = ?", [(i,) for i in affected | changed])
+    cur.executemany(INSERT, found)
+    return len(affected)
@@ -0,0 +1,330 @@
+import sqlite3
+import sys
+from bisect import bisect_left, bisect_right
+import numpy as np
+
+# Cópia só de leitura do catálogo em memória (server.py --snapshot). É carregada
+# uma vez no processo pai, antes do fork: ids e ligações ficam em arrays NumPy,
+# que os filhos partilham sem copiar (copy-on-write), e os nomes são strings
+# internadas. Responde a algumas das queries com nome do app.py (ver db.query);
+# as restantes (pesquisa, FAQ, coleções da API) continuam a ir ao SQLite.
+
+# Registo com a mesma interface que sqlite3.Row: row['x'], row[0], row.x, dict(row)
+class Record:
+  __slots__ = ()
+
+  def __init__(self, *values):
+    for field, value in zip(self.__slots__, values):
+      setattr(self, field, value)
+
+  def __getitem__(self, key):
+    return getattr(self, key if isinstance(key, str) else self.__slots__[key])
+
+  def keys(self):
+    return list(self.__slots__)
+
+def record(*fields):
+  return type('Record', (Record,), {'__slots__': fields})
+
+Count = record('total')
+Stats = record('n_movies', 'n_people', 'n_genres', 'n_production_companies')
+ShowHeader = record('show_id', 'title', 'releaseDate', 'rating', 'num_seasons', 'tagline',
+                    'description', 'duration', 'metascore', 'userscore', 'has_scores')
+ShowItem = record('show_id', 'title', 'sort_value', 'sort_key')
+ShowLink = record('role', 'person_id', 'producer_id', 'name')
+SimilarShow = record('show_id', 'title', 'score')
+ShowTitle = record('show_id', 'title')
+PersonShow = record('show_id', 'title', 'role')
+Genre = record('genre_id', 'name')
+GenreInfo = record('genre_name', 'total')
+Company = record('producer_id', 'name')
+ProducerInfo = record('producer_name', 'total')
+Person = record('person_id', 'name')
+PersonItem = record('person_id', 'name', 'roles')
+
+ROLES = ['actor', 'creator', 'director', 'writer']
+ROLE_CODES = ' '.join("WHEN '{}' THEN {}".format(r, i) for i, r in enumerate(ROLES))
+
+# ordenações da lista de shows, iguais às do SHOW_SORTS do app.py:
+# (valor mostrado, chave de ordenação, descendente?)
+SHOW_SORTS = {
+  'title': (lambda s, i: s.title[i], lambda s, i: s.title[i], False),
+  'releaseDate': (lambda s, i: s.release[i],
+                  lambda s, i: '' if s.release[i] is None else str(s.release[i]), True),
+  'metascore': (lambda s, i: s.metascore[i],
+                lambda s, i: -1 if s.metascore[i] is None else s.metascore[i], True),
+  'userscore': (lambda s, i: s.userscore[i],
+                lambda s, i: -1 if s.userscore[i] is None else s.userscore[i], True),
+}
+
+def intern(values):
+  return [sys.intern(v) if isinstance(v, str) else v for v in values]
+
+# ids e posição de cada um num vetor indexado por (id - menor id): procura O(1)
+class Index:
+  def __init__(self, ids):
+    self.ids = np.asarray(ids, dtype=np.int64)
+    self.low = int(self.ids.min()) if len(self.ids) else 0
+    size = int(self.ids.max()) - self.low + 1 if len(self.ids) else 0
+    self.slot = np.full(size, -1, dtype=np.int32)
+    self.slot[self.ids - self.low] = np.arange(len(self.ids), dtype=np.int32)
+
+  def find(self, id):
+    i = id - self.low
+    if 0 <= i < len(self.slot) and self.slot[i] >= 0:
+      return int(self.slot[i])
+    return None
+
+  def positions(self, ids):
+    return self.slot[np.asarray(ids, dtype=np.int64) - self.low]
+
+# Listas de adjacência em CSR: os vizinhos da posição i estão em
+# values[start[i]:start[i + 1]], pela ordem em que a query os devolveu
+class Adjacency:
+  def __init__(self, owners, n, **columns):
+    self.start = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owners, minlength=n), out=self.start[1:])
+    for name, values in columns.items():
+      setattr(self, name, values)
+
+  def range(self, i):
+    return range(self.start[i], self.start[i + 1])
+
+# tabela de nomes (genres, companies, people): ids, nomes e ordem da listagem
+class Names:
+  def __init__(self, rows):
+    self.index = Index([r[0] for r in rows])
+    self.name = intern(r[1] for r in rows)
+    self.extra = [intern(r[i] for r in rows) for i in range(2, len(rows[0]))] if rows else []
+    self.order = np.array(sorted(range(len(rows)), key=lambda i: (self.name[i], rows[i][0])),
+                          dtype=np.int32)
+
+  def id(self, i):
+    return int(self.index.ids[i])
+
+class Snapshot:
+  def __init__(self, c):
+    self.build = (c.execute("SELECT value FROM metadata WHERE key = 'build'").fetchone() or [None])[0]
+
+    rows = c.execute('''
+      SELECT s.show_id, title, releaseDate, rating, num_seasons, tagline, description, duration,
+             m.metascore, u.userscore,
+             m.show_id IS NOT NULL AND u.show_id IS NOT NULL AS has_scores
+      FROM shows s
+      LEFT JOIN metascore m ON m.show_id = s.show_id
+      LEFT JOIN userscore u ON u.show_id = s.show_id
+      ORDER BY s.show_id
+    ''').fetchall()
+    self.shows = Index([r[0] for r in rows])
+    self.title = intern(r[1] for r in rows)
+    self.release = intern(r[2] for r in rows)
+    self.rating = intern(r[3] for r in rows)
+    self.num_seasons = [r[4] for r in rows]
+    self.tagline = [r[5] for r in rows]
+    self.description = [r[6] for r in rows]
+    self.duration = [r[7] for r in rows]
+    self.metascore = [r[8] for r in rows]
+    self.userscore = [r[9] for r in rows]
+    self.has_scores = np.array([r[10] for r in rows], dtype=np.int8)
+    del rows
+
+    self.genres = Names(c.execute('SELECT genre_id, name FROM genres ORDER BY genre_id').fetchall())
+    self.companies = Names(c.execute('SELECT producer_id, name FROM companies ORDER BY producer_id')
+                           .fetchall())
+    self.people = Names(c.execute('SELECT person_id, name, roles FROM people ORDER BY person_id')
+                        .fetchall())
+
+    #ordem de cada listagem de shows, sempre ascendente por (chave, show_id)
+    self.sorts = {}
+    ids = self.shows.ids.tolist()
+    for sort, (_, key, _) in SHOW_SORTS.items():
+      keys = [key(self, i) for i in range(len(ids))]
+      self.sorts[sort] = np.array(sorted(range(len(ids)), key=lambda i: (keys[i], ids[i])),
+                                  dtype=np.int32)
+
+    n = len(self.title)
+    shows, genres = self.links(c, '''
+      SELECT show_id, genre_id FROM types NATURAL JOIN genres ORDER BY show_id, name
+    ''')
+    self.show_genres = Adjacency(self.shows.positions(shows), n, genre=self.genres.index.positions(genres))
+
+    shows, people, roles = self.links(c, '''
+      SELECT show_id, person_id, CASE role {} END
+      FROM person_roles ORDER BY show_id, role, person_id
+    '''.format(ROLE_CODES), 3)
+    self.show_people = Adjacency(self.shows.positions(shows), n,
+                                 person=self.people.index.positions(people), role=roles.astype(np.int8))
+
+    shows, companies = self.links(c, '''
+      SELECT show_id, producer_id FROM production ORDER BY show_id, producer_id
+    ''')
+    self.show_companies = Adjacency(self.shows.positions(shows), n,
+                                    company=self.companies.index.positions(companies))
+
+    rows = c.execute('SELECT show_id, similar_id, score FROM similar_shows ORDER BY show_id, rank').fetchall()
+    self.similar = Adjacency(self.shows.positions([r[0] for r in rows]), n,
+                             show=self.shows.positions([r[1] for r in rows]),
+                             score=np.array([r[2] for r in rows], dtype=np.float64))
+
+    genres, shows = self.links(c, '''
+      SELECT genre_id, show_id FROM types NATURAL JOIN shows ORDER BY genre_id, title, show_id
+    ''')
+    self.genre_shows = Adjacency(self.genres.index.positions(genres), len(self.genres.name),
+                                 show=self.shows.positions(shows))
+
+    companies, shows = self.links(c, '''
+      SELECT producer_id, show_id FROM production NATURAL JOIN shows ORDER BY producer_id, title, show_id
+    ''')
+    self.company_shows = Adjacency(self.companies.index.positions(companies), len(self.companies.name),
+                                   show=self.shows.positions(shows))
+
+    people, shows, roles = self.links(c, '''
+      SELECT r.person_id, r.show_id, CASE r.role {} END
+      FROM person_roles r JOIN shows m ON m.show_id = r.show_id
+      ORDER BY r.person_id, m.title, m.show_id, r.role
+    '''.format(ROLE_CODES), 3)
+    self.person_shows = Adjacency(self.people.index.positions(people), len(self.people.name),
+                                  show=self.shows.positions(shows), role=roles.astype(np.int8))
+
+  # queries do app.py a que a cópia responde: nome -> (método, argumentos fixos).
+  # Guardam-se nomes e não funções ligadas à instância, para a cópia não ficar
+  # num ciclo de referências (só o GC cíclico a libertaria, e o gc.freeze() do
+  # server.py impede-o)
+  QUERIES = {
+    'stats': ('stats',),
+    'shows_count': ('count', 'shows'),
+    'genres_count': ('count', 'genres'),
+    'companies_count': ('count', 'companies'),
+    'people_count': ('count', 'people'),
+    'show_header': ('show_header',),
+    'show_links': ('show_links',),
+    'show_similar': ('show_similar',),
+    'genres_page': ('page', 'genres', Genre),
+    'genre_info': ('info', 'genres', 'genre_shows', GenreInfo),
+    'genre_shows': ('shows_of', 'genres', 'genre_shows'),
+    'companies_page': ('page', 'companies', Company),
+    'producer_info': ('info', 'companies', 'company_shows', ProducerInfo),
+    'producer_shows': ('shows_of', 'companies', 'company_shows'),
+    'people_page': ('page', 'people', PersonItem),
+    'person': ('person',),
+    'person_shows': ('person_show_list',),
+  }
+  for sort in SHOW_SORTS:
+    QUERIES['shows_{}_offset'.format(sort)] = ('offset_query', sort)
+    QUERIES['shows_{}_after'.format(sort)] = ('keyset_query', sort, True)
+    QUERIES['shows_{}_before'.format(sort)] = ('keyset_query', sort, False)
+  del sort
+
+  def query(self, name, args):
+    method, *fixed = self.QUERIES[name]
+    return getattr(self, method)(*fixed, *args)
+
+  #colunas inteiras (só inteiros) de uma query de ligações
+  @staticmethod
+  def links(c, sql, columns=2):
+    return np.array(c.execute(sql).fetchall(), dtype=np.int64).reshape(-1, columns).T
+
+  def count(self, table):
+    return [Count(len(self.title) if table == 'shows' else len(getattr(self, table).name))]
+
+  def stats(self):
+    return [Stats(len(self.title), len(self.people.name), len(self.genres.name),
+                  len(self.companies.name))]
+
+  def show_item(self, sort, i):
+    value, key, _ = SHOW_SORTS[sort]
+    return ShowItem(int(self.shows.ids[i]), self.title[i], value(self, i), key(self, i))
+
+  # a ordem guardada é ascendente: nas ordenações descendentes lê-se do fim
+  def offset_query(self, sort, limit, offset):
+    order, desc = self.sorts[sort], SHOW_SORTS[sort][2]
+    n = len(order)
+    if desc:
+      positions = order[max(n - offset - limit, 0):max(n - offset, 0)][::-1]
+    else:
+      positions = order[offset:offset + limit]
+    return [self.show_item(sort, int(i)) for i in positions]
+
+  # linhas depois (after) ou antes (before) do cursor (chave, show_id), pela
+  # mesma ordem que a query SQL correspondente devolve
+  def keyset_query(self, sort, after, value, _, show_id, limit):
+    order, key, desc = self.sorts[sort], SHOW_SORTS[sort][1], SHOW_SORTS[sort][2]
+    cursor = (value, show_id)
+    sort_key = lambda i: (key(self, i), self.shows.ids[i])
+    if after != desc:
+      start = bisect_right(order, cursor, key=sort_key)
+      positions = order[start:start + limit]
+    else:
+      end = bisect_left(order, cursor, key=sort_key)
+      positions = order[max(end - limit, 0):end][::-1]
+    return [self.show_item(sort, int(i)) for i in positions]
+
+  def show_header(self, id):
+    i = self.shows.find(id)
+    if i is None:
+      return []
+    return [ShowHeader(id, self.title[i], self.release[i], self.rating[i], self.num_seasons[i],
+                       self.tagline[i], self.description[i], self.duration[i], self.metascore[i],
+                       self.userscore[i], int(self.has_scores[i]))]
+
+  # a mesma ordem que o ORDER BY role, person_id, producer_id, name do SQL
+  def show_links(self, id, *_):
+    i = self.shows.find(id)
+    if i is None:
+      return []
+    people = self.show_people
+    links = [ShowLink(ROLES[people.role[j]], self.people.id(people.person[j]), None,
+                      self.people.name[people.person[j]]) for j in people.range(i)]
+    links += [ShowLink('genre', None, None, self.genres.name[self.show_genres.genre[j]])
+              for j in self.show_genres.range(i)]
+    links += [ShowLink('producer', None, self.companies.id(self.show_companies.company[j]),
+                       self.companies.name[self.show_companies.company[j]])
+              for j in self.show_companies.range(i)]
+    links.sort(key=lambda l: l.role)
+    return links
+
+  def show_similar(self, id):
+    i = self.shows.find(id)
+    if i is None:
+      return []
+    return [SimilarShow(int(self.shows.ids[self.similar.show[j]]), self.title[self.similar.show[j]],
+                        float(self.similar.score[j])) for j in self.similar.range(i)]
+
+  def page(self, names, kind, limit, offset):
+    names = getattr(self, names)
+    return [kind(names.id(i), names.name[i], *(column[i] for column in names.extra))
+            for i in names.order[offset:offset + limit]]
+
+  def info(self, names, shows, kind, id):
+    names, shows = getattr(self, names), getattr(self, shows)
+    i = names.index.find(id)
+    total = len(shows.range(i)) if i is not None else 0
+    return [kind(names.name[i] if total else None, total)]
+
+  def shows_of(self, names, shows, id):
+    names, shows = getattr(self, names), getattr(self, shows)
+    i = names.index.find(id)
+    if i is None:
+      return []
+    return [ShowTitle(int(self.shows.ids[shows.show[j]]), self.title[shows.show[j]]) for j in shows.range(i)]
+
+  def person(self, id):
+    i = self.people.index.find(id)
+    return [Person(id, self.people.name[i])] if i is not None else []
+
+  def person_show_list(self, id):
+    i = self.people.index.find(id)
+    if i is None:
+      return []
+    shows = self.person_shows
+    return [PersonShow(int(self.shows.ids[shows.show[j]]), self.title[shows.show[j]], ROLES[shows.role[j]])
+            for j in shows.range(i)]
+
+# Abre a BD numa ligação própria, fechada no fim: o processo que carrega a
+# cópia (o pai, no server.py) não fica com ligações que os filhos herdariam
+def load(path):
+  c = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+  try:
+    return Snapshot(c)
+  finally:
+    c.close()
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# constrói a BD numa pasta temporária a partir do CSV, com o top_cast dos
+# primeiros shows trocado por 'casts'; devolve quais desses nomes ficaram
+def build(tmp_path, casts):
+  shows = pd.read_csv(os.path.join(HERE, "tv_shows.csv"))
+  shows.loc[:len(casts) - 1, "top_cast"] = casts
+  shows.to_csv(tmp_path / "tv_shows.csv", index=False)
+  subprocess.run([sys.executable, os.path.join(HERE, "create_bd.py")], cwd=tmp_path,
+                 check=True, stdout=subprocess.DEVNULL)
+  wanted = {name for cast in casts for name in cast.split(",")}
+  conn = sqlite3.connect(tmp_path / "Metacritic.db")
+  names = {name for name, in conn.execute("SELECT name FROM people") if name in wanted}
+  conn.close()
+  return names
+
+def test_latin_accents_are_merged(tmp_path):
+  assert build(tmp_path, ["José Ruiz", "Jose  RUIZ"]) == {"José Ruiz"}
+
+def test_non_latin_marks_are_kept(tmp_path):
+  # ガ/カ (japonês) e किशन/कशन (devanágari) só diferem em marcas combinantes
+  names = build(tmp_path, ["ガズオ,किशन", "カズオ,कशन"])
+  assert names == {"ガズオ", "カズオ", "किशन", "कशन"}